@@ -1,38 +1,60 @@
 import os
 import json
-from googleapiclient import discovery
-from googleapiclient.errors import HttpError
 from datasets import load_dataset
-import time
 import pandas as pd
 from sklearn.linear_model import LogisticRegression
 import numpy as np
-import math
 from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
 import matplotlib
 import matplotlib.pyplot as plt
-from token_handler import handle_tokens
+from eval_runner import run_concurrent
+from scoring import LogisticModel, model_path
+from perspective_client import PerspectiveClient, is_transient
 
+# Default Perspective quota is 1 query per second; raise this if your project has more
+PERSPECTIVE_QPS = 1.0
+MAX_WORKERS = 4
+CHECKPOINT_DIR = "checkpoints"
 
-def eval_text(google, message):
+
+def eval_text(perspective, message):
     analyze_request = {
         "comment": {"text": message},
         "requestedAttributes": {"IDENTITY_ATTACK": {}, "INSULT": {}, "THREAT": {}},
     }
     try:
-        response = google.comments().analyze(body=analyze_request).execute()
+        response = perspective.analyze(analyze_request)
         probs = {
             flag: response["attributeScores"][flag]["summaryScore"]["value"]
             for flag in response["attributeScores"]
         }
         return probs
-    except HttpError as e:
-        this_error = e
+    except Exception as e:
         if "LANGUAGE_NOT_SUPPORTED_BY_ATTRIBUTE" in str(e):
             return {}
-        breakpoint()
-        # if  "Attribute THREAT does not support request languages":
-        #     return
+        raise
+
+
+def skip_row(error):
+    # Give up on the row for this run: like an unsupported language, the empty result is
+    # dropped before training and evaluation. It isn't checkpointed, so the next run tries it again.
+    print(f"Skipping row after error: {error}")
+    return {}
+
+
+def score_texts(texts, checkpoint_name):
+    # PerspectiveClient keeps one googleapiclient object per worker thread
+    perspective = PerspectiveClient()
+    rows = list(enumerate(texts))
+    return run_concurrent(
+        lambda text: eval_text(perspective, text),
+        rows,
+        os.path.join(CHECKPOINT_DIR, checkpoint_name),
+        rate=PERSPECTIVE_QPS,
+        max_workers=MAX_WORKERS,
+        should_retry=is_transient,
+        on_failure=skip_row,
+    )
 
 
 def trainGooglePerspective():
@@ -41,21 +63,7 @@ def trainGooglePerspective():
     hate_datasets = load_dataset("classla/FRENK-hate-en", "multiclass")
     val_df = hate_datasets["validation"].to_pandas()
 
-    API_KEY = handle_tokens("google")
-
-    google = discovery.build(
-        "commentanalyzer",
-        "v1alpha1",
-        developerKey=API_KEY,
-        discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-        static_discovery=False,
-    )
-
-    model_output = []
-    for i in range(val_df.shape[0]):
-        print(i)
-        time.sleep(1)
-        model_output.append(eval_text(google, val_df.loc[val_df.index[i], "text"]))
+    model_output = score_texts(val_df["text"].tolist(), "perspective_validation.jsonl")
 
     model_output = pd.DataFrame(model_output)
     y = val_df[~model_output.isna().sum(axis=1).astype(bool)].label.values
@@ -65,52 +73,26 @@ def trainGooglePerspective():
     print(
         f"\nOptimal coefficients are: intercept={clf.intercept_[0]}, {model_output.columns[0]}={clf.coef_[0][0]}, {model_output.columns[1]}={clf.coef_[0][1]}, {model_output.columns[2]}={clf.coef_[0][2]}\n"
     )
+    model = LogisticModel.from_sklearn("perspective", clf, list(model_output.columns))
+    model.save()
+    print(f"Saved {model_path('perspective')} (version {model.version})")
     breakpoint()
 
 
-def sigmoid(x):
-    return 1 / (1 + math.exp(-x))
-
-
 def evaluateGooglePerspective():
-    COEFFS = {
-        "intercept": -1.8430630461127375,
-        "INSULT": 3.0665049605198584,
-        "IDENTITY_ATTACK": 0.21195243081036308,
-        "THREAT": 0.16239476863923974,
-    }
+    model = LogisticModel.load("perspective")
     hate_datasets = load_dataset("classla/FRENK-hate-en", "multiclass")
     test_df = hate_datasets["test"].to_pandas()
     test_df = test_df.iloc[:100,]
 
-    API_KEY = handle_tokens("google")
-
-    google = discovery.build(
-        "commentanalyzer",
-        "v1alpha1",
-        developerKey=API_KEY,
-        discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-        static_discovery=False,
-    )
-
-    model_output = []
-    for i in range(test_df.shape[0]):
-        print(i)
-        time.sleep(1)
-        output = eval_text(google, test_df.loc[test_df.index[i], "text"])
-
-        score = 0
-        for key in output:
-            score += COEFFS[key] * output[key]
-        score += COEFFS["intercept"]
-
-        score = sigmoid(score)
-        model_output.append(score)
+    outputs = score_texts(test_df["text"].tolist(), "perspective_test.jsonl")
 
-    model_output = np.array(model_output)
-    y_true = test_df[~np.isnan(model_output).astype(bool)].label.values
+    # predict_proba would turn an empty result into sigmoid(intercept), so drop those rows first
+    scored = np.array([bool(output) for output in outputs])
+    test_df = test_df[scored]
+    y_true = test_df.label.values
     y_true = np.where((y_true == 1) | (y_true == 2), 1, 0)
-    y_pred_scores = model_output[~np.isnan(model_output)]
+    y_pred_scores = model.predict_proba([output for output in outputs if output])
     y_pred = np.where(y_pred_scores > 0.5, 1, 0)
     cm = confusion_matrix(y_true, y_pred, labels=[0, 1])
     cm = cm / cm.sum()
@@ -1,54 +1,90 @@
 import os
 import openai
-import datasets
 import json
-import pandas as pd
 import numpy as np
-import math
-from tqdm import tqdm
-import time
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-import matplotlib
-import matplotlib.pyplot as plt
-# from token_handler import handle_tokens
+from token_handler import credentials
+from eval_runner import run_concurrent
+from scoring import LogisticModel, model_path
 
 # from bot import ModBot
 
+# datasets, pandas, sklearn and matplotlib are only needed for training/evaluation,
+# so they're imported inside those methods to keep the bot's startup light
+
+
+# Budget for the bulk scoring jobs; each request scores up to BATCH_SIZE rows
+REQUESTS_PER_MINUTE = 60
+BATCH_SIZE = 32
+MAX_WORKERS = 4
+CHECKPOINT_DIR = "checkpoints"
+
+
+def should_retry(error):
+    return isinstance(
+        error,
+        (
+            openai.error.RateLimitError,
+            openai.error.APIError,
+            openai.error.Timeout,
+            openai.error.APIConnectionError,
+            openai.error.ServiceUnavailableError,
+        ),
+    )
+
 
 class OpenAIMod:
-    def __init__(self):
-        self.ds = datasets.load_dataset("classla/FRENK-hate-en", "multiclass")
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, batch_size=BATCH_SIZE):
+        self._ds = None
+        self.requests_per_minute = requests_per_minute
+        self.batch_size = batch_size
+
+    # The FRENK dataset is only needed for training/evaluation, so load it on first use
+    # rather than every time the bot builds a classifier
+    @property
+    def ds(self):
+        if self._ds is None:
+            import datasets
+
+            self._ds = datasets.load_dataset("classla/FRENK-hate-en", "multiclass")
+        return self._ds
 
     def eval_text(self, message):
-        token_path = "tokens.json"
-        if not os.path.isfile(token_path):
-            raise Exception(f"{token_path} not found!")
-        with open(token_path) as f:
-            # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-            tokens = json.load(f)
-            openai_token = tokens["open_ai"]
-
-        openai.api_key = openai_token
-        response = openai.Moderation.create(input=message)
+        return self.eval_batch([message])[0]
+
+    def eval_batch(self, messages):
+        # The moderation endpoint accepts a list of inputs and returns one result per input, in order
+        # Pass the key per request instead of setting openai.api_key, so a reload takes effect immediately
+        response = openai.Moderation.create(
+            input=list(messages), api_key=credentials.get("open_ai")
+        )
         output = response["results"]
 
         detecting = ["hate", "hate/threatening", "violence"]
-        for key in output:
-            probs = {type: key["category_scores"][type] for type in detecting}
-
-        return probs
+        return [
+            {type: key["category_scores"][type] for type in detecting}
+            for key in output
+        ]
+
+    def score_rows(self, texts, checkpoint_name):
+        # Batched, rate-limited and resumable: rows already in the checkpoint file are not sent again
+        return run_concurrent(
+            self.eval_batch,
+            list(enumerate(texts)),
+            os.path.join(CHECKPOINT_DIR, checkpoint_name),
+            rate=self.requests_per_minute / 60,
+            max_workers=MAX_WORKERS,
+            should_retry=should_retry,
+            batch_size=self.batch_size,
+        )
 
     def trainOpenAI(self):
         # additional training specifically on a dataset involving LGBT-related speech in hopes of further improving at those types of speech
+        import pandas as pd
+        from sklearn.linear_model import LogisticRegression
 
         valset = self.ds["validation"].to_pandas()
 
-        output = []
-        for i in tqdm(range(valset.shape[0])):
-            time.sleep(1)
-            open_ai = self.eval_text(valset.loc[valset.index[i], "text"])
-            output.append(open_ai)
+        output = self.score_rows(valset["text"].tolist(), "openai_validation.jsonl")
 
         output = pd.DataFrame(output)
         y = valset[~output.isna().sum(axis=1).astype(bool)].label.values
@@ -56,16 +92,19 @@ class OpenAIMod:
         X = output[~output.isna().sum(axis=1).astype(bool)].values
         clf = LogisticRegression(random_state=0).fit(X, y)
         print(
-            f"\nOptimal coefficients are: intercept={clf.intercept_[0]}, {model_output.columns[0]}={clf.coef_[0][0]}, {model_output.columns[1]}={clf.coef_[0][1]}, {model_output.columns[2]}={clf.coef_[0][2]}\n"
+            f"\nOptimal coefficients are: intercept={clf.intercept_[0]}, {output.columns[0]}={clf.coef_[0][0]}, {output.columns[1]}={clf.coef_[0][1]}, {output.columns[2]}={clf.coef_[0][2]}\n"
         )
+        model = LogisticModel.from_sklearn("openai_moderation", clf, list(output.columns))
+        model.save()
+        print(f"Saved {model_path('openai_moderation')} (version {model.version})")
         breakpoint()
 
-    def sigmoid(self, x):
-        return 1 / (1 + math.exp(-x))
-
     def get_cm(self, ds, model_output, title):
         if not isinstance(title, str):
             raise TypeError("title must be a string")
+        from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+        import matplotlib
+        import matplotlib.pyplot as plt
 
         # edited it to see what I could do (this is the commented out section beneath this)
         # and wasn't able to change anything
@@ -115,28 +154,16 @@ class OpenAIMod:
         return y_true, y_pred_scores, y_pred
 
     def evalOpenAI(self):
-        COEFFS = {
-            "intercept": -1.6949516955386068,
-            "hate": 2.514414538130454,
-            "hate/threatening": -0.11870110156245899,
-            "violence": -0.7040727776293726,
-        }
+        import pandas as pd
+
+        model = LogisticModel.load("openai_moderation")
 
         testset = self.ds["test"].to_pandas()
         testset = testset.iloc[:100,]
 
-        model_output = []
-        for i in tqdm(range(testset.shape[0])):
-            time.sleep(1)
-            output = self.eval_text(testset.loc[testset.index[i], "text"])
-
-            score = 0
-            for key in output:
-                score += COEFFS[key] * output[key]
+        outputs = self.score_rows(testset["text"].tolist(), "openai_test.jsonl")
 
-            score += COEFFS["intercept"]
-            score = self.sigmoid(score)
-            model_output.append(score)
+        model_output = model.predict_proba(outputs)
 
         # print(len(model_output))
         # print(testset.shape)
@@ -155,12 +182,7 @@ class OpenAIMod:
     # combo1: adding scores output by both models, reverifying if the combined score > 5
     # combo2: inputting messages flagged by Google Perspective into OpenAI
     def evalCombos(self):
-        COEFFS = {
-            "intercept": -1.6949516955386068,
-            "hate": 2.514414538130454,
-            "hate/threatening": -0.11870110156245899,
-            "violence": -0.7040727776293726,
-        }
+        import pandas as pd
 
         testset = self.ds["test"].to_pandas()
         testset = testset.iloc[:100,]
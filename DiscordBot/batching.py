@@ -0,0 +1,59 @@
+import asyncio
+
+
+class MicroBatcher:
+    """
+    Collects items submitted within a short window (or until max_batch_size is
+    reached), scores them with a single call to batch_fn and hands each caller
+    back its own result. batch_fn is an async callable taking a list of items
+    and returning a list of results in the same order; an Exception instance in
+    place of a result fails just that item's caller.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=32, max_wait=0.05):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []  # List of (item, future) waiting for the next flush
+        self._timer = None
+
+    async def __call__(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.batch_fn(items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        if len(results) != len(batch):
+            # Nothing above the batcher times out, so a caller left without a result would wait forever
+            error = ValueError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            for _, future in batch[len(results):]:
+                if not future.done():
+                    future.set_exception(error)
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# bench_report_memory.py
+# Memory benchmark for the review backlog: bytes per queued report when each
+# report keeps a live message object (the old Report) versus the compact
+# ReportRecord with a MessageRef snapshot.
+#
+# discord.Message can't be built without a gateway connection, so the "before"
+# case uses a stand-in with the same attribute layout. A real Message also pins
+# its guild, channel, member and state caches, so real savings are larger.
+import argparse
+import gc
+import tracemalloc
+from types import SimpleNamespace
+
+from report import MessageRef, Report, ReportRecord
+
+
+class StandInMessage:
+    def __init__(self, i):
+        self.id = 1100000000000000000 + i
+        self.content = f"offending message number {i} with some typical chat text"
+        self.author = SimpleNamespace(id=900000000000000000 + i, name=f"user{i}", bot=False)
+        self.guild = SimpleNamespace(id=1000000000000000000)
+        self.channel = SimpleNamespace(id=1000000000000000001, name="group-0")
+        self.attachments = []
+        self.embeds = []
+        self.mentions = []
+        self.reactions = []
+        self.created_at = None
+        self.edited_at = None
+        self.reference = None
+        self.flags = 0
+
+
+def build_old(n, client):
+    reports = []
+    for i in range(n):
+        report = Report(client)
+        report.reporter_id = 800000000000000000 + i
+        report.offending_message = StandInMessage(i)
+        report.categories[i % 5] = True
+        reports.append(report)
+    return reports
+
+
+def build_new(n):
+    reports = []
+    for i in range(n):
+        message = StandInMessage(i)
+        reports.append(
+            ReportRecord(
+                800000000000000000 + i,
+                MessageRef.from_message(message),
+                category_mask=1 << (i % 5),
+            )
+        )
+    return reports
+
+
+def measure(build, n):
+    gc.collect()
+    tracemalloc.start()
+    reports = build(n)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del reports
+    return size / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=20000)
+    args = parser.parse_args()
+
+    client = object()
+    old = measure(lambda n: build_old(n, client), args.reports)
+    new = measure(build_new, args.reports)
+    print(f"Queued reports: {args.reports}")
+    print(f"Report + message object:    {old:8.0f} bytes/report")
+    print(f"ReportRecord + MessageRef:  {new:8.0f} bytes/report")
+    print(f"Reduction: {100 * (1 - new / old):.0f}%")
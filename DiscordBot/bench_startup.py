@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# bench_startup.py
+# Import-time benchmark for the bot. Imports bot.py in a fresh interpreter and
+# fails (exit code 1) if startup pulls in training-only libraries or takes
+# longer than the budget.
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Libraries only the training/evaluation scripts need
+FORBIDDEN_MODULES = ["sklearn", "matplotlib", "pandas", "datasets", "tqdm"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure(runs):
+    timings = []
+    modules = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD],
+            capture_output=True,
+            text=True,
+            check=True,
+            # `python -c` puts the working directory on sys.path, which is how the child finds bot.py
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(data["seconds"])
+        modules.update(data["modules"])
+    return sorted(timings)[len(timings) // 2], modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.5,
+        help="Maximum median import time of bot.py in seconds.",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    median, modules = measure(args.runs)
+    loaded = [
+        name
+        for name in FORBIDDEN_MODULES
+        if name in modules or any(m.startswith(name + ".") for m in modules)
+    ]
+    print(f"bot.py import: median {median * 1000:.0f} ms over {args.runs} runs")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: training-only modules imported at startup: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget:
+        print(f"FAIL: startup exceeded budget of {args.budget * 1000:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 # bot.py
+import asyncio
 import discord
 
 # from discord.ext import commands
@@ -8,71 +9,171 @@ import json
 import logging
 import re
 import requests
+from collections import deque
 
-from googleapiclient import discovery
-from report import Report, Review
+from report import MessageRef, Report, ReportRecord, Review
 import pdb
 from data_manager import DataManager
-from analyzeOpenAI import OpenAIMod
-from chatCompletion import ChatCompletionMod
-import math
-from token_handler import handle_tokens
-
-# Coefficients for Google Perspective classification
-GOOGLE_COEFFS = {
-    "intercept": -1.3228379330359248,
-    "INSULT": 3.8921009196729774,
-    "IDENTITY_ATTACK": 0.9563236343157535,
-    "THREAT": 0.31681785782996336,
-}
-
-# Coefficients for OpenAI classification
-OPENAI_COEFFS = {
-    "intercept": -1.5949516955386068,
-    "hate": 2.514414538130454,
-    "hate/threatening": -0.11870110156245899,
-    "violence": -0.704727776293726,
-}
-
-# Set up logging to the console
-logger = logging.getLogger("discord")
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
-handler.setFormatter(
-    logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s")
-)
-logger.addHandler(handler)
-
-discord_token, GOOGLE_API_KEY, OPENAI_API_KEY = handle_tokens("bot")
-
-google = discovery.build(
-    "commentanalyzer",
-    "v1alpha1",
-    developerKey=GOOGLE_API_KEY,
-    discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-    static_discovery=False,
-)
-
-
-def sigmoid(x):
-    return 1 / (1 + math.exp(-x))
+from review_queue import ReviewQueue
+from storage import SQLiteStore
+from token_handler import credentials, install_reload_signal
+from classifiers import ClassifierRegistry, is_rejection, is_transient
+from score_cache import ScoreCache
+from scoring import LogisticModel
+from perspective_client import PerspectiveClient
+from cascade import POLICIES, SEQUENTIAL, CascadeExecutor, Stage
+from prefilter import ESCALATE, FLAG, SKIP, PreFilter
+from intake_queue import IntakeQueue
+from message_resolver import MessageResolver
+from flood_tracker import FloodTracker
+from metrics import REGISTRY, Counter, Gauge, MetricsServer
+from mod_dispatcher import HIGH, NORMAL, ModChannelDispatcher, ModNotice
+from chatCompletion import FLAGGED_LABELS
+from log_setup import LOG_PATH, parse_levels, setup_logging
+
+# Handlers are attached by log_setup.setup_logging() when run as a script
+log = logging.getLogger("modbot")
+
+# Messages that couldn't be scored are kept (up to this many) and retried on this interval
+MAX_DEFERRED = 1000
+DEFERRED_RETRY_INTERVAL = 15
+# Scoring attempts before a deferred message is given up on
+MAX_SCORE_ATTEMPTS = 5
+# Channel messages that can wait for a scorer before on_message starts waiting too
+INTAKE_SIZE = 1000
 
 
 class ModBot(discord.Client):
-    def __init__(self):
+    def __init__(
+        self,
+        model_type=None,
+        score_cache_path=None,
+        perspective_backend="discovery",
+        db_path="moderation.db",
+        combo_policy=SEQUENTIAL,
+        prefilter_model=False,
+        intake_journal=None,
+        intake_workers=4,
+        metrics_port=None,
+    ):
         intents = discord.Intents.default()
         try:
             intents.message_content = True
         except:
             intents.messages = True
         super().__init__(command_prefix=".", intents=intents)
+        # Classifier used to score channel messages; None disables scoring
+        self.model_type = model_type
         self.group_num = None
         self.mod_channels = {}  # Map from guild to the mod channel id for that guild
         self.reports = {}  # Map from user IDs to the state of their report
-        self.unreviewed = {}  # Map from user IDs to unreviewed reports
+        # Reporter statistics and queued reports are kept in SQLite so they survive restarts
+        self.store = SQLiteStore(db_path)
+        self.data_manager = DataManager(self.store)
+        # Submitted reports waiting for a moderator, by category and priority
+        self.unreviewed = ReviewQueue(self.data_manager, store=self.store)
+        self.unreviewed.restore()
         self.reviews = {}  # Map from user IDs to the state of their review
-        self.data_manager = DataManager()
+        # Looks up messages linked in reports, caching them for pile-ons
+        self.resolver = MessageResolver(self)
         self.report_in_progress = False
+        # Built lazily on first use; rebuilt when tokens.json is reloaded
+        self.perspective = PerspectiveClient(backend=perspective_backend)
+        credentials.on_reload(self.perspective.reset)
+        # Classifiers are built once here and reused for every message
+        self.classifiers = ClassifierRegistry(
+            eval_google=self.eval_google, cache=ScoreCache(path=score_cache_path)
+        )
+        # Fitted coefficients written by analyzeGooglePerspective / analyzeOpenAI
+        self.models = {
+            "google": LogisticModel.load("perspective"),
+            "open_ai": LogisticModel.load("openai_moderation"),
+        }
+        # Combo mode: flag only if both Perspective and OpenAI score the message above 0.5
+        self.cascade = CascadeExecutor(
+            [
+                Stage("google", self.classifiers["google"], self.models["google"]),
+                Stage("open_ai", self.classifiers["open_ai"], self.models["open_ai"]),
+            ],
+            policy=combo_policy,
+        )
+        # Local checks that keep benign chatter away from the paid classifiers
+        self.prefilter = PreFilter.from_file()
+        # Per-author and per-channel message rates, so floods are caught without classifier calls
+        self.flood = FloodTracker()
+        self.prefilter_model = prefilter_model
+        # (ref, attempts) for messages waiting to be scored because no classifier was available
+        self.deferred = deque(maxlen=MAX_DEFERRED)
+        # Batches and rate-limits what the bot posts to mod channels
+        self.dispatcher = ModChannelDispatcher()
+        # Channel messages waiting to be forwarded and scored; unprocessed ones are replayed on restart
+        self.intake = IntakeQueue(
+            maxsize=INTAKE_SIZE, journal_path=intake_journal, workers=intake_workers
+        )
+        # Served at http://127.0.0.1:<metrics_port>/metrics when a port is given
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.messages_scored = REGISTRY.register(
+            Counter("modbot_messages_scored_total", help="Messages scored, by model type")
+        )
+        self.auto_reports = REGISTRY.register(
+            Counter("modbot_auto_reports_total", help="Automatic reports filed")
+        )
+        REGISTRY.register(
+            Gauge(
+                "modbot_review_queue_depth",
+                help="Review items waiting for a moderator",
+                fn=lambda: len(self.unreviewed),
+            )
+        )
+        REGISTRY.register(
+            Gauge(
+                "modbot_deferred_messages",
+                help="Messages waiting for a classifier to become available",
+                fn=lambda: len(self.deferred),
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_flood_escalations_total",
+                help="Authors escalated for flooding",
+                fn=lambda: self.flood.escalations,
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_flood_suppressed_total",
+                help="Messages not scored because their author was flooding",
+                fn=lambda: self.flood.suppressed,
+            )
+        )
+
+    async def setup_hook(self):
+        install_reload_signal(asyncio.get_running_loop())
+        self.flush_task = asyncio.create_task(self.flush_periodically())
+        self.rescore_task = asyncio.create_task(self.rescore_deferred())
+        if self.metrics_port:
+            self.metrics_server = await MetricsServer(port=self.metrics_port).start()
+        if self.prefilter_model and self.model_type is not None:
+            # Training imports sklearn and takes a moment, so keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.prefilter.train_model
+            )
+
+    async def flush_periodically(self):
+        # Buffered statistics are otherwise only written once enough updates pile up
+        while True:
+            await asyncio.sleep(self.store.flush_interval)
+            self.store.flush()
+
+    async def close(self):
+        self.intake.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        await self.dispatcher.flush()
+        self.classifiers.shutdown()
+        self.store.close()
+        await super().close()
 
     async def on_ready(self):
         print(f"{self.user.name} has connected to Discord! It is these guilds:")
@@ -95,6 +196,17 @@ class ModBot(discord.Client):
                 if channel.name == f"group-{self.group_num}-mod":
                     self.mod_channels[guild.id] = channel
 
+        # Workers need the mod channels, so they start once those are known
+        if not self.intake.running:
+            await self.intake.start(self.process_message)
+
+    async def on_raw_message_edit(self, payload):
+        # A cached snapshot of an edited message is stale
+        self.resolver.forget(payload.guild_id, payload.channel_id, payload.message_id)
+
+    async def on_raw_message_delete(self, payload):
+        self.resolver.forget(payload.guild_id, payload.channel_id, payload.message_id)
+
     async def on_message(self, message):
         """
         This function is called whenever a message is sent in a channel that the bot can see (including DMs).
@@ -130,9 +242,6 @@ class ModBot(discord.Client):
         # If we don't currently have an active report for this user, add one
         if author_id not in self.reports:
             self.reports[author_id] = Report(self)
-            self.unreviewed[author_id] = [self.reports[author_id]]
-        else:
-            self.unreviewed[author_id].append(Report(self))
 
         # Let the report class handle this message; forward all the messages it returns to uss
         responses = await self.reports[author_id].handle_message(message)
@@ -143,15 +252,12 @@ class ModBot(discord.Client):
         if self.reports[author_id].report_complete():
             if not self.reports[author_id].cancelled:
                 self.data_manager.add_user_report(author_id)
+                # Only finished reports go to moderators
+                self.unreviewed.push(self.reports[author_id].to_queued())
             self.reports.pop(author_id)
 
     async def handle_channel_message(self, message):
-        # Forward the message to the mod channel
         mod_channel = self.mod_channels[message.guild.id]
-        if message.channel.name == f"group-{self.group_num}":
-            await mod_channel.send(
-                f'Forwarded message:\n{message.author.name}: "{message.content}"'
-            )
 
         if message.channel.name == f"group-{self.group_num}-mod":
             # Handle a help message
@@ -205,6 +311,9 @@ class ModBot(discord.Client):
                     author_id in self.reviews
                     and self.reviews[author_id].review_cancelled()
                 ):
+                    # Put the report back so another moderator can pick it up
+                    if self.reviews[author_id].report is not None:
+                        self.unreviewed.requeue(self.reviews[author_id].report)
                     self.reviews.pop(author_id)
                     self.report_in_progress = False
 
@@ -221,146 +330,360 @@ class ModBot(discord.Client):
                     author_id in self.reviews
                     and self.reviews[author_id].review_complete()
                 ):
-                    user_report_id = self.reviews[author_id].user_report_id
                     await message.channel.send("Done. Review complete.")
-                    # if report is accurate, increment accurate reports count by one
-                    if not self.reviews[author_id].noaction:
-                        self.data_manager.add_true_report(user_report_id)
-                    # if report isn't cancelled, increment confirmed reports by one
-                    if not self.reviews[author_id].review_cancelled():
-                        self.data_manager.add_confirmed_report(user_report_id)
+                    # Everyone who reported a message in the cluster gets credit for the outcome
+                    reporters = {
+                        reporter
+                        for report in self.reviews[author_id].report.cluster()
+                        for reporter in report.all_reporters()
+                    }
+                    for user_report_id in reporters:
+                        # if report is accurate, increment accurate reports count by one
+                        if not self.reviews[author_id].noaction:
+                            self.data_manager.add_true_report(user_report_id)
+                        # if report isn't cancelled, increment confirmed reports by one
+                        if not self.reviews[author_id].review_cancelled():
+                            self.data_manager.add_confirmed_report(user_report_id)
+                    self.unreviewed.remove(self.reviews[author_id].report)
                     self.reviews.pop(author_id)
-                    self.unreviewed[user_report_id].pop(0)
-                    if not self.unreviewed[user_report_id]:
-                        self.unreviewed.pop(user_report_id)
                     self.report_in_progress = False
 
         if message.channel.name == f"group-{self.group_num}":
+            ref = MessageRef.from_message(message)
+            # Other bots' messages (and echoes) are forwarded but never scored
+            if message.author.bot:
+                self.dispatcher.send(mod_channel, self.forward_line(ref))
+                return
+            # Forwarding and scoring happen on the intake workers, so a burst doesn't stall the gateway
+            await self.intake.put(ref)
 
-            async def file_automatic_report():
-                await mod_channel.send("**Made automatic report.**")
-                report = Report(self)
-                report.reporter_id = "BOT"
-                report.offending_message = message
-                self.data_manager.add_user_report("BOT")
-                if "BOT" not in self.unreviewed:
-                    self.unreviewed["BOT"] = []
-                self.unreviewed["BOT"].append(report)
-
-            if model_type == "google":
-                # google_score = self.eval_google(message)
-                # openai_scores = OpenAIMod.discord_eval(message)
-                scores = self.eval_google(message)
-                score = 0
-                for key in scores:
-                    score += GOOGLE_COEFFS[key] * scores[key]
-                score += GOOGLE_COEFFS["intercept"]
-                score = sigmoid(score)
-
-                if score > 0.5:
-                    await file_automatic_report()
-                await mod_channel.send(self.code_format(score))
-
-            elif model_type == "open_ai":
-                openai_model = OpenAIMod()
-                scores = openai_model.eval_text(message.content)
-                score = 0
-                for key in scores:
-                    score += OPENAI_COEFFS[key] * scores[key]
-                score += OPENAI_COEFFS["intercept"]
-                score = sigmoid(score)
-
-                if score > 0.5:
-                    await file_automatic_report()
-                await mod_channel.send(self.code_format(score))
-
-            elif model_type == "chat_completion":
-                chatcompletion_model = ChatCompletionMod()
-
-                # text_type, either violent speech, hateful speech, phishing, scam, spam, or not threatening
-                text_type = chatcompletion_model.eval_text(message.content)
-                await mod_channel.send(
-                    f'Forwarded message:\n{message.author.name}: "{message.content}"'
+        return
+
+    def forward_line(self, ref):
+        return f'Forwarded message:\n{ref.author_name}: "{ref.content}"'
+
+    async def process_message(self, ref):
+        # Run by the intake workers for every message in group-N.
+        # Everything posted about the message goes to the mod channel as one notice.
+        notice = ModNotice()
+        notice.add(self.forward_line(ref), NORMAL)
+        try:
+            # The local checks cost nothing, so they run even for authors who are flooding
+            decision = self.prefilter.decide(ref.content)
+            status = self.flood.observe(ref, suspicious=decision.action != SKIP)
+            # Recent activity worth showing the moderator alongside an automatic report
+            burst = status.to_dict() if status.messages > 1 or status.channel_burst else None
+            # Without --model_type nothing is flagged or scored; only floods are reported
+            if decision.action == FLAG and self.model_type is not None:
+                self.file_automatic_report(ref, notice, burst=burst)
+                notice.add(f"Flagged by pre-filter ({decision.reason}).", HIGH)
+            elif status.newly_escalated:
+                self.file_automatic_report(ref, notice, burst=burst)
+            if status.newly_escalated:
+                notice.add(
+                    f"**{ref.author_name} is flooding the channel ({status.reason}); "
+                    "their messages won't be sent to the classifiers for the next few minutes.**",
+                    HIGH,
                 )
-                await mod_channel.send(
-                    "This message is classified by chat completion model as: "
-                    + text_type
+                return
+            if decision.action != ESCALATE:
+                return
+            if status.escalated:
+                # Already reported for flooding; scoring every line would only cost more calls
+                self.flood.suppressed += 1
+                notice.add(f"Not scored: {ref.author_name} is flooding the channel.")
+                return
+            if not await self.score_message(ref, notice, burst):
+                self.defer(ref, notice)
+                # Held unacknowledged in the intake journal until it is scored
+                return True
+        finally:
+            self.dispatcher.send(self.mod_channels[ref.guild_id], notice)
+
+    def file_automatic_report(self, ref, notice, score=None, burst=None):
+        notice.add("**Made automatic report.**", HIGH)
+        self.auto_reports.inc()
+        report = ReportRecord("BOT", ref, score=score, burst=burst)
+        self.data_manager.add_user_report("BOT")
+        self.unreviewed.push(report)
+        log.info(
+            "Filed automatic report",
+            extra={"report_id": report.report_id, "message_id": ref.message_id, "author_id": ref.author_id},
+        )
+
+    def pick_model(self):
+        # The configured model if its providers are up, otherwise the first healthy alternative
+        preferred = self.model_type
+        for model in [preferred] + [m for m in ALLOWED_MODEL_TYPES if m != preferred]:
+            if all(self.classifiers.available(p) for p in MODEL_PROVIDERS[model]):
+                return model
+        if self.prefilter.model is not None:
+            return LOCAL_MODEL
+        return None
+
+    async def score_message(self, ref, notice, burst=None):
+        # Returns False if the message couldn't be scored for now and should be tried again later
+        if self.model_type is None:
+            return True
+        model = self.pick_model()
+        if model is None:
+            return False
+        try:
+            await self.score_with(model, ref, notice, burst)
+            self.messages_scored.inc(model=model)
+        except Exception as e:
+            if is_rejection(e):
+                # The provider refused this message (e.g. an unsupported language); a retry won't help
+                log.info(
+                    "%s rejected message %s: %r",
+                    model,
+                    ref.message_id,
+                    e,
+                    extra={"message_id": ref.message_id, "provider": model},
+                )
+                notice.add(f"Could not score this message: {model} rejected it.")
+                return True
+            if is_transient(e):
+                log.warning(
+                    "Scoring message %s with %s failed: %r",
+                    ref.message_id,
+                    model,
+                    e,
+                    extra={"message_id": ref.message_id, "provider": model},
                 )
+            else:
+                # A config problem (e.g. a missing token) or a bug; retried until MAX_SCORE_ATTEMPTS
+                log.exception(
+                    "Scoring message %s with %s raised unexpectedly",
+                    ref.message_id,
+                    model,
+                    extra={"message_id": ref.message_id, "provider": model},
+                )
+            return False
+        return True
 
-                if (
-                    text_type.lower() == "violent speech."
-                    or text_type.lower() == "hateful speech."
-                    or text_type.lower() == "scam."
-                    or text_type.lower() == "this is a phishing message."
-                ):
-                    await file_automatic_report()
-
-            elif model_type == "combo":
-                # Combination of openai and google perspective (the ones that require our own training)
-                google_scores = self.eval_google(message)
-                google_score = 0
-                for key in google_scores:
-                    google_score += GOOGLE_COEFFS[key] * google_scores[key]
-                google_score += GOOGLE_COEFFS["intercept"]
-                google_score = sigmoid(google_score)
-
-                if google_score > 0.5:
-                    openai_model = OpenAIMod()
-                    openai_scores = openai_model.eval_text(message.content)
-                    openai_score = 0
-                    for key in openai_scores:
-                        openai_score += OPENAI_COEFFS[key] * openai_scores[key]
-                    openai_score += OPENAI_COEFFS["intercept"]
-                    openai_score = sigmoid(openai_score)
-
-                    if openai_score > 0.5:
-                        await file_automatic_report()
-
-                        if (
-                            max(openai_scores, key=openai_scores.get)
-                            == "hate/threatening"
-                        ):
-                            await mod_channel.send(
-                                "**This message may be illegal or cause immediate harm to users.**"
-                            )
+    def defer(self, ref, notice, attempts=1):
+        if attempts == 1:
+            notice.add(
+                "Could not score this message yet; it will be scored once a classifier is available."
+            )
+        if len(self.deferred) == self.deferred.maxlen:
+            # Not released, so a journaled message is still scored after the next restart
+            dropped = self.deferred[0][0].message_id
+            log.warning(
+                "Deferred queue full; message %s won't be retried until restart",
+                dropped,
+                extra={"message_id": dropped},
+            )
+        self.deferred.append((ref, attempts))
+
+    async def rescore_deferred(self):
+        # Retry deferred messages once some classifier is available again. The mod channel
+        # only hears about a deferred message again once it is scored or given up on.
+        while True:
+            await asyncio.sleep(DEFERRED_RETRY_INTERVAL)
+            while self.deferred and self.pick_model() is not None:
+                ref, attempts = self.deferred.popleft()
+                notice = ModNotice()
+                notice.add(
+                    f'Scoring deferred message:\n{ref.author_name}: "{ref.content}"', NORMAL
+                )
+                if not await self.score_message(ref, notice):
+                    attempts += 1
+                    if attempts < MAX_SCORE_ATTEMPTS:
+                        self.defer(ref, notice, attempts)
+                        break
+                    log.warning(
+                        "Giving up on message %s after %d attempts",
+                        ref.message_id,
+                        attempts,
+                        extra={"message_id": ref.message_id},
+                    )
+                    notice.add(f"Gave up scoring this message after {attempts} attempts.")
+                self.intake.release(ref)
+                self.dispatcher.send(self.mod_channels[ref.guild_id], notice)
+
+    async def score_with(self, model, ref, notice, burst=None):
+        if model == "google":
+            # google_score = self.eval_google(message)
+            # openai_scores = OpenAIMod.discord_eval(message)
+            scores = await self.classifiers["google"](ref.content)
+            score = self.models["google"].score(scores)
+
+            if score > 0.5:
+                self.file_automatic_report(ref, notice, score, burst)
+            notice.add(self.code_format(score, model))
+
+        elif model == "open_ai":
+            scores = await self.classifiers["open_ai"](ref.content)
+            score = self.models["open_ai"].score(scores)
+
+            if score > 0.5:
+                self.file_automatic_report(ref, notice, score, burst)
+            notice.add(self.code_format(score, model))
+
+        elif model == "chat_completion":
+            # One of chatCompletion.LABELS, with the model's confidence
+            result = await self.classifiers["chat_completion"](ref.content)
+            notice.add(
+                "This message is classified by chat completion model as: "
+                f"{result['label']} (confidence {result['confidence']:.2f})"
+            )
 
-        return
+            if result["label"] in FLAGGED_LABELS:
+                self.file_automatic_report(ref, notice, result["confidence"], burst)
 
-    def eval_google(self, message):
+        elif model == "combo":
+            # Combination of openai and google perspective (the ones that require our own training)
+            result = await self.cascade.run(ref.content)
+
+            if result.flagged:
+                self.file_automatic_report(ref, notice, result.score, burst)
+
+                openai_scores = result.outputs["open_ai"]
+                if max(openai_scores, key=openai_scores.get) == "hate/threatening":
+                    notice.add(
+                        "**This message may be illegal or cause immediate harm to users.**",
+                        HIGH,
+                    )
+
+        elif model == LOCAL_MODEL:
+            # Every provider is down; the pre-filter's local model stands in
+            score = self.prefilter.model_score(ref.content)
+            if score > 0.5:
+                self.file_automatic_report(ref, notice, score, burst)
+            notice.add(self.code_format(score, model))
+
+    def eval_google(self, text):
         analyze_request = {
-            "comment": {"text": message.content},
+            "comment": {"text": text},
             "requestedAttributes": {"IDENTITY_ATTACK": {}, "INSULT": {}, "THREAT": {}},
         }
-        response = google.comments().analyze(body=analyze_request).execute()
+        response = self.perspective.analyze(analyze_request)
         probs = {
             flag: response["attributeScores"][flag]["summaryScore"]["value"]
             for flag in response["attributeScores"]
         }
         return probs
 
-    def code_format(self, text):
-        if model_type == "google":
+    def code_format(self, text, model=None):
+        model = model or self.model_type
+        if model == LOCAL_MODEL:
+            return "Evaluated by the local fallback model: '" + str(text) + "'"
+        if model == "google":
             return "Evaluated by Google Perspective: '" + str(text) + "'"
-        if model_type == "open_ai":
+        if model == "open_ai":
             return "Evaluated by OpenAI: '" + str(text) + "'"
-        if model_type == "chat_completion":
+        if model == "chat_completion":
             pass
-        if model_type == "combo":
+        if model == "combo":
             return "Evaluated by Google Perspective and OpenAI: '" + str(text) + "'"
 
 
 import argparse
 
 ALLOWED_MODEL_TYPES = ["google", "open_ai", "chat_completion", "combo"]
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--model_type",
-    type=str,
-    choices=ALLOWED_MODEL_TYPES,
-    help="Specify the model type (google, open_ai, chat_completion, combo). Google will use the google perspective model, with additional training on an LGBT-speech related dataset. chat_completion will train on openAI's chat completion model, a general-use tool to generate conversational responses to a prompt (in this case, classifying the user's speech as violent, hateful, or non-threatening). open_ai will train on OpenAI's moderation model, a tool specifically meant to flag inappropriate content. Combo will do a combination of open_ai and google.",
-)
-args = parser.parse_args()
-model_type = args.model_type
-
-client = ModBot()
-client.run(discord_token)
+# Providers each model type calls; a model type is only used while all of them are available
+MODEL_PROVIDERS = {
+    "google": ("google",),
+    "open_ai": ("open_ai",),
+    "chat_completion": ("chat_completion",),
+    "combo": ("google", "open_ai"),
+}
+# Last resort when every provider is down: the pre-filter's model (needs --prefilter_model)
+LOCAL_MODEL = "local"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_type",
+        type=str,
+        choices=ALLOWED_MODEL_TYPES,
+        help="Specify the model type (google, open_ai, chat_completion, combo). Google will use the google perspective model, with additional training on an LGBT-speech related dataset. chat_completion will train on openAI's chat completion model, a general-use tool to generate conversational responses to a prompt (in this case, classifying the user's speech as violent, hateful, or non-threatening). open_ai will train on OpenAI's moderation model, a tool specifically meant to flag inappropriate content. Combo will do a combination of open_ai and google.",
+    )
+    parser.add_argument(
+        "--score_cache",
+        type=str,
+        default=None,
+        help="Optional SQLite file for the classifier score cache, so cached scores survive restarts.",
+    )
+    parser.add_argument(
+        "--db",
+        type=str,
+        default="moderation.db",
+        help="SQLite file for reporter statistics and reports waiting for review.",
+    )
+    parser.add_argument(
+        "--combo_policy",
+        type=str,
+        choices=POLICIES,
+        default=SEQUENTIAL,
+        help="combo mode only: sequential calls OpenAI only for messages Perspective flags; speculative calls both at once and cancels the other as soon as one clears the message.",
+    )
+    parser.add_argument(
+        "--prefilter_model",
+        action="store_true",
+        help="Train a small local TF-IDF model on FRENK's train split at startup and skip messages it is confident are benign (needs scikit-learn and datasets).",
+    )
+    parser.add_argument(
+        "--intake_journal",
+        type=str,
+        default=None,
+        help="Optional JSONL file journaling channel messages until they are scored, so none are lost on restart.",
+    )
+    parser.add_argument(
+        "--intake_workers",
+        type=int,
+        default=4,
+        help="Number of workers forwarding and scoring channel messages.",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics at http://127.0.0.1:<port>/metrics.",
+    )
+    parser.add_argument(
+        "--log_file",
+        type=str,
+        default=LOG_PATH,
+        help="JSON log file; rotated once it reaches 10 MB, keeping 5 old files.",
+    )
+    parser.add_argument(
+        "--log_level",
+        type=str,
+        action="append",
+        default=[],
+        metavar="LOGGER=LEVEL",
+        help="Log level for one subsystem, e.g. discord=DEBUG or modbot.intake=WARNING. Can be repeated.",
+    )
+    parser.add_argument(
+        "--perspective_backend",
+        type=str,
+        choices=["discovery", "http"],
+        default="discovery",
+        help="Use googleapiclient (discovery) or a plain pooled HTTP client (http) for Perspective.",
+    )
+    args = parser.parse_args()
+    try:
+        log_levels = parse_levels(args.log_level)
+    except ValueError as e:
+        parser.error(str(e))
+    log_listener = setup_logging(args.log_file, log_levels)
+
+    client = ModBot(
+        model_type=args.model_type,
+        score_cache_path=args.score_cache,
+        perspective_backend=args.perspective_backend,
+        db_path=args.db,
+        combo_policy=args.combo_policy,
+        prefilter_model=args.prefilter_model,
+        intake_journal=args.intake_journal,
+        intake_workers=args.intake_workers,
+        metrics_port=args.metrics_port,
+    )
+    try:
+        # log_handler=None keeps discord.py from adding its own handler to the root logger
+        client.run(credentials.get("discord"), log_handler=None)
+    finally:
+        log_listener.stop()
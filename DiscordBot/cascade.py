@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from metrics import REGISTRY, Counter, Histogram
+
+SEQUENTIAL = "sequential"
+SPECULATIVE = "speculative"
+POLICIES = (SEQUENTIAL, SPECULATIVE)
+
+
+class Stage:
+    def __init__(self, name, classify, model, threshold=0.5):
+        self.name = name
+        # Async callable text -> raw attribute scores
+        self.classify = classify
+        # LogisticModel turning the raw scores into one probability
+        self.model = model
+        self.threshold = threshold
+
+
+class CascadeResult:
+    def __init__(self):
+        self.flagged = False
+        self.outputs = {}  # Map from stage name to raw provider output
+        self.scores = {}  # Map from stage name to model score
+        # Score of the stage that cleared the message, or of the final stage if flagged
+        self.score = None
+
+    def add(self, stage, output):
+        self.outputs[stage.name] = output
+        self.score = self.scores[stage.name] = stage.model.score(output)
+        return self.score > stage.threshold
+
+
+class CascadeExecutor:
+    """
+    Runs classifier stages where a message is flagged only if every stage scores
+    it above its threshold.
+
+    sequential: call a stage only after the previous one flagged the message.
+        Cheapest: later providers only see messages earlier ones flagged.
+    speculative: call every stage at once and stop waiting for the rest as soon
+        as one clears the message. Time-to-flag is the slowest stage instead of
+        the sum. The abandoned provider calls are not cancelled: CachedClassifier
+        shields them so their results still reach the cache, and they are still
+        paid for.
+
+    Latency of every stage and of the whole cascade is kept in histograms.
+    """
+
+    def __init__(self, stages, policy=SEQUENTIAL):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cascade policy: {policy}")
+        self.stages = stages
+        self.policy = policy
+        self.histograms = {
+            stage.name: REGISTRY.register(
+                Histogram(
+                    "modbot_cascade_stage_seconds",
+                    help="Latency of each combo cascade stage",
+                    labels={"stage": stage.name},
+                )
+            )
+            for stage in stages
+        }
+        self.histograms["total"] = REGISTRY.register(
+            Histogram("modbot_cascade_seconds", help="Latency of the whole combo cascade")
+        )
+        self.cancelled = 0  # Speculative stages no longer waited for because another one cleared the message
+        REGISTRY.register(
+            Counter(
+                "modbot_cascade_cancelled_total",
+                help="Speculative stages no longer waited for because another stage cleared the message",
+                fn=lambda: self.cancelled,
+            )
+        )
+
+    async def _timed(self, stage, text):
+        start = time.perf_counter()
+        output = await stage.classify(text)
+        self.histograms[stage.name].observe(time.perf_counter() - start)
+        return output
+
+    async def run(self, text):
+        with self.histograms["total"].time():
+            if self.policy == SPECULATIVE:
+                return await self._run_speculative(text)
+            return await self._run_sequential(text)
+
+    async def _run_sequential(self, text):
+        result = CascadeResult()
+        for stage in self.stages:
+            if not result.add(stage, await self._timed(stage, text)):
+                return result
+        result.flagged = True
+        return result
+
+    async def _run_speculative(self, text):
+        result = CascadeResult()
+        pending = {
+            asyncio.ensure_future(self._timed(stage, text)): stage for stage in self.stages
+        }
+        try:
+            # Handle stages in the order they answer; the first one to clear the message decides
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = pending.pop(task)
+                    if not result.add(stage, task.result()):
+                        return result
+            result.flagged = True
+            result.score = result.scores[self.stages[-1].name]
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+                self.cancelled += 1
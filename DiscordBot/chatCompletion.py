@@ -1,7 +1,69 @@
 import os
 import openai
 import json
-from token_handler import handle_tokens
+from token_handler import credentials
+
+VIOLENT_SPEECH = "violent speech"
+HATEFUL_SPEECH = "hateful speech"
+SPAM = "spam"
+SCAM = "scam"
+PHISHING = "phishing"
+NOT_THREATENING = "not threatening"
+LABELS = (VIOLENT_SPEECH, HATEFUL_SPEECH, SPAM, SCAM, PHISHING, NOT_THREATENING)
+# Labels that file an automatic report
+FLAGGED_LABELS = (VIOLENT_SPEECH, HATEFUL_SPEECH, SCAM, PHISHING)
+
+# Most messages classified in one prompt
+MAX_BATCH_SIZE = 10
+# The answer is only the function call arguments. One result takes ~20 tokens compact and
+# ~35 when the model pretty-prints it, so leave room for the latter plus the wrapper.
+TOKENS_PER_MESSAGE = 60
+BASE_TOKENS = 50
+
+SYSTEM_PROMPT = (
+    "You are a content moderation system. You are given a JSON list of messages, "
+    'each an object with an "index" and a "text". '
+    "Classify each message as violent speech, hateful speech, spam, scam, phishing, "
+    "or not threatening, with your confidence between 0 and 1. "
+    "Answer by calling classify with one result per message, copying the message's "
+    "index unchanged."
+)
+
+CLASSIFY_FUNCTION = {
+    "name": "classify",
+    "description": "Record the moderation label of each message.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "index": {
+                            "type": "integer",
+                            "description": "The index given with the message, copied unchanged.",
+                        },
+                        "label": {"type": "string", "enum": list(LABELS)},
+                        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+                    },
+                    "required": ["index", "label", "confidence"],
+                },
+            }
+        },
+        "required": ["results"],
+    },
+}
+
+
+class IncompleteAnswer(Exception):
+    # The model's answer was cut off or isn't valid JSON; asking again may well work
+    pass
+
+
+class UnlabelledMessage(ValueError):
+    # The model answered, but gave this message no valid label
+    pass
 
 
 class ChatCompletionMod:
@@ -9,21 +71,60 @@ class ChatCompletionMod:
         pass
 
     def eval_text(self, message):
-        openai.organization, openai.api_key = handle_tokens("chat_completion")
+        result = self.eval_batch([message])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
+    def eval_batch(self, messages):
+        # Returns one {"label": ..., "confidence": ...} per message, in order. A message the
+        # model gave no valid label for gets an UnlabelledMessage in its place; the others still count.
+        messages = list(messages)
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
+            api_key=credentials.get("open_ai"),
+            organization=credentials.get("openai_organization"),
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are a content moderation system. Classify each input as either violent speech, hateful speech, spam, scam, phishing, or not threatening.",
-                },
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {
                     "role": "user",
-                    "content": message,
+                    "content": json.dumps(
+                        [{"index": i, "text": message} for i, message in enumerate(messages)]
+                    ),
                 },
             ],
+            # Forcing the function call keeps the answer to the label enum
+            functions=[CLASSIFY_FUNCTION],
+            function_call={"name": "classify"},
+            temperature=0,
+            max_tokens=BASE_TOKENS + TOKENS_PER_MESSAGE * len(messages),
         )
 
-        output = response["choices"][0]["message"]["content"]
-        return output
+        choice = response["choices"][0]
+        if choice.get("finish_reason") == "length":
+            # Ran out of tokens mid-answer; halves of the batch need half the room
+            if len(messages) > 1:
+                middle = len(messages) // 2
+                return self.eval_batch(messages[:middle]) + self.eval_batch(messages[middle:])
+            raise IncompleteAnswer("Chat completion answer was cut off")
+        try:
+            answer = json.loads(choice["message"]["function_call"]["arguments"])["results"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise IncompleteAnswer(f"Chat completion answer could not be parsed: {e!r}")
+
+        results = {}
+        for result in answer:
+            # A malformed item only costs its own message
+            try:
+                index = result["index"]
+                label = result["label"]
+                confidence = min(max(float(result.get("confidence", 0)), 0.0), 1.0)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if label in LABELS and isinstance(index, int):
+                results[index] = {"label": label, "confidence": confidence}
+        return [
+            results.get(i)
+            or UnlabelledMessage(f"Chat completion returned no valid label for message {i}")
+            for i in range(len(messages))
+        ]
@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+
+from metrics import REGISTRY, Counter, Gauge
+
+CLOSED = "closed"  # Calls go through
+OPEN = "open"  # Calls fail straight away until reset_timeout has passed
+HALF_OPEN = "half_open"  # One probe call is let through to test the provider
+# Exported as the circuit state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last `window` calls to one provider. Once at least
+    min_calls have been made and the failure rate reaches failure_threshold, the
+    circuit opens and calls fail immediately with CircuitOpenError instead of
+    waiting on a provider that is down. After reset_timeout seconds one probe
+    call is let through: success closes the circuit, failure opens it again.
+
+    A call that takes longer than timeout seconds counts as a failure. The
+    caller stops waiting for it, but a request already running on a worker
+    thread still finishes in the background. Other errors only count if
+    is_failure(error) says so; an error the provider returns for one bad input
+    (e.g. a 400) shows the provider is up and counts as a success.
+    """
+
+    def __init__(
+        self,
+        name,
+        timeout=10.0,
+        window=20,
+        min_calls=5,
+        failure_threshold=0.5,
+        reset_timeout=30.0,
+        is_failure=lambda error: True,
+    ):
+        self.name = name
+        self.is_failure = is_failure
+        self.timeout = timeout
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True for each success, False for each failure
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0  # Calls refused while open
+        labels = {"provider": name}
+        self.errors = REGISTRY.register(
+            Counter(
+                "modbot_provider_errors_total",
+                help="Provider calls that failed or timed out",
+                labels=labels,
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_provider_rejected_total",
+                help="Provider calls refused because the circuit was open",
+                labels=labels,
+                fn=lambda: self.rejected,
+            )
+        )
+        REGISTRY.register(
+            Gauge(
+                "modbot_circuit_state",
+                help="Circuit breaker state: 0 closed, 1 half open, 2 open",
+                labels=labels,
+                fn=lambda: STATE_VALUES[self.state],
+            )
+        )
+
+    def available(self):
+        # Whether a call made now would be attempted
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+        if self.state == HALF_OPEN:
+            return not self._probing
+        return True
+
+    def _before_call(self):
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpenError(self.name)
+        if self.state == HALF_OPEN:
+            self._probing = True
+
+    def _record(self, success):
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if success:
+                self.state = CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        self._outcomes.append(success)
+        failures = self._outcomes.count(False)
+        if (
+            len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_threshold
+        ):
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    async def call(self, fn, *args):
+        self._before_call()
+        try:
+            result = await asyncio.wait_for(fn(*args), self.timeout)
+        except asyncio.CancelledError:
+            # Our caller gave up (e.g. a speculative cascade stage); says nothing about the provider
+            if self.state == HALF_OPEN:
+                self._probing = False
+            raise
+        except asyncio.TimeoutError:
+            self.errors.inc()
+            self._record(False)
+            raise
+        except Exception as e:
+            failed = self.is_failure(e)
+            if failed:
+                self.errors.inc()
+            self._record(not failed)
+            raise
+        self._record(True)
+        return result
+
+    def wrap(self, fn):
+        async def guarded(*args):
+            return await self.call(fn, *args)
+
+        return guarded
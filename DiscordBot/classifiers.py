@@ -0,0 +1,139 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from analyzeOpenAI import OpenAIMod, should_retry as openai_should_retry
+from batching import MicroBatcher
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from chatCompletion import MAX_BATCH_SIZE, ChatCompletionMod, IncompleteAnswer, UnlabelledMessage
+from metrics import REGISTRY, Histogram
+from perspective_client import error_status, is_transient as perspective_is_transient
+from score_cache import CachedClassifier, ScoreCache
+
+# Max number of in-flight requests we allow per provider
+DEFAULT_CONCURRENCY = {
+    "google": 8,
+    "open_ai": 8,
+    "chat_completion": 4,
+}
+
+# Cache namespace for providers whose output format has changed, so old entries aren't reused
+CACHE_NAMESPACES = {
+    "chat_completion": "chat_completion_labels",
+}
+
+
+def is_transient(error):
+    """
+    Whether a failed classifier call may succeed later: timeouts, dropped
+    connections, rate limits, server errors, open circuits and cut-off chat
+    completion answers. Anything else (a 400, an unsupported language) fails
+    the same way on every retry.
+    """
+    if isinstance(error, (asyncio.TimeoutError, CircuitOpenError, IncompleteAnswer)):
+        return True
+    return perspective_is_transient(error) or openai_should_retry(error)
+
+
+def is_rejection(error):
+    """
+    Whether a provider answered but refused this particular message: a 4xx
+    from Perspective (e.g. LANGUAGE_NOT_SUPPORTED_BY_ATTRIBUTE), an OpenAI
+    invalid request, or a message chat completion left unlabelled. Config
+    errors and bugs are neither this nor transient.
+    """
+    if isinstance(error, (UnlabelledMessage, openai.error.InvalidRequestError)):
+        return True
+    status = error_status(error)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+class AsyncClassifier:
+    """
+    Wraps a blocking classifier call so it can be awaited from the event loop.
+    The call runs on a small thread pool owned by this provider, and a semaphore
+    caps how many requests to the provider can be outstanding at once.
+    """
+
+    def __init__(self, name, fn, max_concurrency=None):
+        self.name = name
+        self.fn = fn
+        self.max_concurrency = max_concurrency or DEFAULT_CONCURRENCY.get(name, 4)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix=f"classify-{name}"
+        )
+        # Created lazily so it binds to the loop discord.py is running on
+        self._semaphore = None
+        self.latency = REGISTRY.register(
+            Histogram(
+                "modbot_provider_call_seconds",
+                help="Latency of each provider request, excluding time waiting for a slot",
+                labels={"provider": name},
+            )
+        )
+
+    async def __call__(self, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            with self.latency.time():
+                return await loop.run_in_executor(self._executor, self.fn, *args)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class ClassifierRegistry:
+    """
+    Holds one long-lived instance of every provider, created when the bot starts,
+    so scoring a message never pays for constructing a classifier.
+    """
+
+    def __init__(self, eval_google, cache=None):
+        self.openai_model = OpenAIMod()
+        self.chatcompletion_model = ChatCompletionMod()
+        self.providers = {
+            "google": AsyncClassifier("google", eval_google),
+            "open_ai": AsyncClassifier("open_ai", self.openai_model.eval_batch),
+            "chat_completion": AsyncClassifier(
+                "chat_completion", self.chatcompletion_model.eval_batch
+            ),
+        }
+        # A provider that keeps failing or timing out is cut off instead of stalling every message
+        # Only errors that say the provider itself is in trouble count toward opening the circuit
+        self.breakers = {
+            name: CircuitBreaker(name, is_failure=is_transient) for name in self.providers
+        }
+        self.classifiers = {
+            name: self.breakers[name].wrap(provider)
+            for name, provider in self.providers.items()
+        }
+        # Moderation takes a list of inputs, so messages arriving together share one request
+        self.classifiers["open_ai"] = MicroBatcher(
+            self.classifiers["open_ai"], max_batch_size=32, max_wait=0.05
+        )
+        # Chat completion classifies several numbered messages per prompt when they queue up
+        self.classifiers["chat_completion"] = MicroBatcher(
+            self.classifiers["chat_completion"],
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait=0.05,
+        )
+        # Repeated content (spam waves, copypasta) is answered from the cache
+        self.cache = cache if cache is not None else ScoreCache()
+        for name in self.classifiers:
+            self.classifiers[name] = CachedClassifier(
+                CACHE_NAMESPACES.get(name, name), self.classifiers[name], self.cache
+            )
+
+    def __getitem__(self, name):
+        return self.classifiers[name]
+
+    def available(self, name):
+        return self.breakers[name].available()
+
+    def shutdown(self):
+        for provider in self.providers.values():
+            provider.shutdown()
+        self.cache.close()
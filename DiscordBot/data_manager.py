@@ -1,4 +1,11 @@
+from collections import OrderedDict
+
+from storage import SQLiteStore
+
+
 class ReportInfo:
+    __slots__ = ("total_reports_filed", "total_reports_confirmed", "accurate_reports")
+
     def __init__(self):
         self.total_reports_filed = 0
         self.total_reports_confirmed = 0
@@ -11,28 +18,48 @@ class ReportInfo:
 
 
 class DataManager:
-    def __init__(self):
-        # creates dictionary where user ids mad to ReportInfo structs
-        self.user_report_info = dict()
+    def __init__(self, store=None, cache_size=1024):
+        # Statistics live in the store; only recently used users are kept in memory
+        self.store = store if store is not None else SQLiteStore()
+        self.cache_size = cache_size
+        # creates dictionary where user ids map to ReportInfo structs (least recently used first)
+        self.user_report_info = OrderedDict()
+
+    def _get_info(self, user):
+        if user in self.user_report_info:
+            self.user_report_info.move_to_end(user)
+            return self.user_report_info[user]
+        row = self.store.get_user(user)
+        if row is None:
+            raise KeyError(user)
+        info = ReportInfo()
+        info.total_reports_filed, info.total_reports_confirmed, info.accurate_reports = row
+        self.user_report_info[user] = info
+        if len(self.user_report_info) > self.cache_size:
+            self.user_report_info.popitem(last=False)
+        return info
 
     def get_trust_score(self, user):
-        return self.user_report_info[user].get_percentage()
+        return self._get_info(user).get_percentage()
 
     # when a user makes a report, adds it to user statistics
     def add_user_report(self, user):
-        if user not in self.user_report_info:
-            self.user_report_info[user] = ReportInfo()
-        self.user_report_info[user].total_reports_filed += 1
+        self.store.increment(user, "total_reports_filed")
+        if user in self.user_report_info:
+            self.user_report_info[user].total_reports_filed += 1
 
     # returns number of reports a user has made than have been reviewed by mod team
     def get_reports_confirmed(self, user):
-        return self.user_report_info[user].total_reports_confirmed
+        return self._get_info(user).total_reports_confirmed
 
     # when mod team has reviewed a user's report, statistic is kept for that user
     def add_confirmed_report(self, user):
-        self.user_report_info[user].total_reports_confirmed += 1
+        self.store.increment(user, "total_reports_confirmed")
+        if user in self.user_report_info:
+            self.user_report_info[user].total_reports_confirmed += 1
 
     # increases count of accurate reports
     def add_true_report(self, user):
-        self.user_report_info[user].accurate_reports += 1
-
+        self.store.increment(user, "accurate_reports")
+        if user in self.user_report_info:
+            self.user_report_info[user].accurate_reports += 1
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available, so at
+    most `rate` calls per second go out on average, with bursts up to `capacity`.
+    Coroutines use acquire_async(), which sleeps without blocking the event loop.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens):
+        # Takes the tokens and returns 0 if there are enough, otherwise how long until there will be
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+def load_checkpoint(path):
+    # Each line is {"index": row index, "result": classifier output}; later lines win
+    results = {}
+    if path and os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run killed mid-write can leave a partial last line
+                    continue
+                results[record["index"]] = record["result"]
+    return results
+
+
+def call_with_retry(fn, args, should_retry, max_retries=5, base_delay=1.0):
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == max_retries or not should_retry(e):
+                raise
+            # Exponential backoff with jitter so workers don't retry in lockstep
+            time.sleep(base_delay * (2**attempt) * (0.5 + random.random()))
+
+
+def run_concurrent(
+    fn,
+    rows,
+    checkpoint_path,
+    rate,
+    max_workers=8,
+    should_retry=lambda e: True,
+    max_retries=5,
+    on_failure=None,
+    batch_size=None,
+):
+    """
+    Calls fn(payload) for every (index, payload) in rows using a thread pool,
+    never exceeding `rate` requests per second. If batch_size is set, fn is
+    instead called with lists of up to batch_size payloads and must return a
+    list of results in the same order; each batch counts as one request.
+
+    Each result is appended to checkpoint_path as soon as it arrives and rows
+    already in the checkpoint are skipped, so an interrupted run picks up where
+    it stopped. Rows that still fail after retrying get on_failure(error) as
+    their result, which is not checkpointed so the next run retries them. If
+    on_failure is None the error is re-raised once the batches already running
+    have finished and been checkpointed. Returns the results ordered like rows.
+    """
+    results = load_checkpoint(checkpoint_path)
+    todo = [(index, payload) for index, payload in rows if index not in results]
+    print(f"{len(results)} rows already scored, {len(todo)} to go")
+
+    if batch_size:
+        chunks = [todo[i : i + batch_size] for i in range(0, len(todo), batch_size)]
+        call = fn
+    else:
+        chunks = [[row] for row in todo]
+        call = lambda payloads: [fn(payloads[0])]
+
+    bucket = TokenBucket(rate)
+
+    def work(payloads):
+        bucket.acquire()
+        return call(payloads)
+
+    if checkpoint_path and os.path.dirname(checkpoint_path):
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, open(
+        checkpoint_path, "a"
+    ) as checkpoint:
+        futures = {
+            pool.submit(
+                call_with_retry,
+                work,
+                ([payload for _, payload in chunk],),
+                should_retry,
+                max_retries,
+            ): chunk
+            for chunk in chunks
+        }
+        scored = 0
+        saved = set()
+
+        def save(future, chunk_results, checkpointed=True):
+            # Only this thread writes, so lines never interleave
+            chunk = futures[future]
+            saved.add(future)
+            for (index, _), result in zip(chunk, chunk_results):
+                results[index] = result
+                if checkpointed:
+                    checkpoint.write(json.dumps({"index": index, "result": result}) + "\n")
+            checkpoint.flush()
+
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                save(future, future.result())
+            except Exception as e:
+                if on_failure is None:
+                    # Keep queued batches from starting, but checkpoint the ones already running
+                    for other in futures:
+                        other.cancel()
+                    for other in futures:
+                        if other not in saved and other is not future and not other.cancelled():
+                            try:
+                                save(other, other.result())
+                            except Exception:
+                                pass
+                    raise
+                # Not checkpointed, so a resumed run tries these rows again
+                save(future, [on_failure(e) for _ in chunk], checkpointed=False)
+            scored += len(chunk)
+            print(f"{scored}/{len(todo)}")
+
+    return [results[index] for index, _ in rows]
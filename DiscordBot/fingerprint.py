@@ -0,0 +1,102 @@
+import hashlib
+import re
+
+from score_cache import normalize_text
+
+SIMHASH_BITS = 64
+# Messages whose SimHashes differ in at most this many bits count as near-duplicates
+MAX_DISTANCE = 7
+# The hash is split into MAX_DISTANCE + 1 bands: two hashes within MAX_DISTANCE bits
+# must agree exactly on at least one band, so only same-band candidates are compared
+BANDS = MAX_DISTANCE + 1
+BAND_BITS = SIMHASH_BITS // BANDS
+
+_TOKEN = re.compile(r"\w+")
+
+
+def content_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _hash64(token):
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text):
+    """
+    64-bit SimHash over words and word pairs, so changing a word or two in a
+    spam template only flips a few bits. None for text without words (emoji,
+    attachments), which is never clustered.
+    """
+    words = _TOKEN.findall(normalize_text(text))
+    if not words:
+        return None
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = _hash64(feature)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(band, value >> (band * BAND_BITS) & mask) for band in range(BANDS)]
+
+
+class Fingerprint:
+    __slots__ = ("exact", "sim")
+
+    def __init__(self, text):
+        self.exact = content_hash(text)
+        self.sim = simhash(text)
+
+
+class ClusterIndex:
+    """
+    Finds the cluster a message belongs to: one whose messages have the same
+    normalized text, or a SimHash within MAX_DISTANCE bits. Clusters are
+    identified by whatever object the caller adds them under (the review
+    queue uses the cluster's head ReportRecord).
+    """
+
+    def __init__(self):
+        self._exact = {}  # Map from content hash to cluster
+        self._bands = {}  # Map from (band, band value) to list of (simhash, cluster)
+        self._members = {}  # Map from cluster id() to the fingerprints added under it
+
+    def find(self, fingerprint):
+        if fingerprint.sim is None:
+            return None
+        cluster = self._exact.get(fingerprint.exact)
+        if cluster is not None:
+            return cluster
+        for band in _bands(fingerprint.sim):
+            for sim, cluster in self._bands.get(band, ()):
+                if hamming(sim, fingerprint.sim) <= MAX_DISTANCE:
+                    return cluster
+        return None
+
+    def add(self, fingerprint, cluster):
+        if fingerprint.sim is None:
+            return
+        self._exact.setdefault(fingerprint.exact, cluster)
+        for band in _bands(fingerprint.sim):
+            self._bands.setdefault(band, []).append((fingerprint.sim, cluster))
+        self._members.setdefault(id(cluster), []).append(fingerprint)
+
+    def remove(self, cluster):
+        for fingerprint in self._members.pop(id(cluster), ()):
+            if self._exact.get(fingerprint.exact) is cluster:
+                del self._exact[fingerprint.exact]
+            for band in _bands(fingerprint.sim):
+                candidates = [c for c in self._bands.get(band, ()) if c[1] is not cluster]
+                if candidates:
+                    self._bands[band] = candidates
+                else:
+                    self._bands.pop(band, None)
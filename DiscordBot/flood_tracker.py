@@ -0,0 +1,134 @@
+from collections import OrderedDict, deque
+
+from fingerprint import content_hash
+
+# Discord snowflakes carry their creation time in ms since this epoch
+DISCORD_EPOCH = 1420070400000
+
+# An author sending FLOOD_THRESHOLD messages within WINDOW seconds is flooding
+WINDOW = 10.0
+FLOOD_THRESHOLD = 8
+# ...or sending the same suspicious text REPEAT_THRESHOLD times within REPEAT_WINDOW seconds
+REPEAT_THRESHOLD = 3
+REPEAT_WINDOW = 60.0
+# A whole channel getting this many messages in WINDOW seconds is reported as a burst (e.g. a raid)
+CHANNEL_THRESHOLD = 30
+# How long an escalated author's messages skip the paid classifiers
+ESCALATION_TTL = 5 * 60
+# Bound on how many authors/channels are tracked; the least recently active are dropped
+MAX_TRACKED = 10000
+
+
+def snowflake_time(snowflake):
+    # Creation time of a message from its id, so replayed or late messages are placed correctly
+    return ((snowflake >> 22) + DISCORD_EPOCH) / 1000
+
+
+class _Ring:
+    """The last `size` events (timestamp, content hash) for one author or channel."""
+
+    __slots__ = ("events",)
+
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+
+    def add(self, at, digest=None):
+        self.events.append((at, digest))
+
+    def count_since(self, cutoff, digest=None):
+        return sum(
+            1 for at, d in self.events if at >= cutoff and (digest is None or d == digest)
+        )
+
+
+class _LRU(OrderedDict):
+    def __init__(self, max_size, factory):
+        super().__init__()
+        self.max_size = max_size
+        self.factory = factory
+
+    def touch(self, key):
+        value = self.get(key)
+        if value is None:
+            value = self[key] = self.factory()
+            if len(self) > self.max_size:
+                self.popitem(last=False)
+        else:
+            self.move_to_end(key)
+        return value
+
+
+class FloodStatus:
+    __slots__ = ("messages", "repeats", "channel_messages", "escalated", "newly_escalated", "reason")
+
+    def __init__(self, messages, repeats, channel_messages):
+        self.messages = messages  # By this author in the last WINDOW seconds
+        self.repeats = repeats  # Of this exact text by this author in the last REPEAT_WINDOW seconds
+        self.channel_messages = channel_messages  # In this channel in the last WINDOW seconds
+        self.escalated = False  # The author is flooding; don't send their messages to the classifiers
+        self.newly_escalated = False  # This message is the one that tipped them over
+        self.reason = None
+
+    @property
+    def channel_burst(self):
+        return self.channel_messages >= CHANNEL_THRESHOLD
+
+    def to_dict(self):
+        return {
+            "messages": self.messages,
+            "repeats": self.repeats,
+            "channel_messages": self.channel_messages,
+            "window": WINDOW,
+            "repeat_window": REPEAT_WINDOW,
+            "reason": self.reason,
+        }
+
+
+class FloodTracker:
+    """
+    Sliding-window message counts per author and per channel, kept locally so a
+    flood costs no classifier calls. Each author or channel holds a fixed-size
+    ring of recent events, and at most MAX_TRACKED of each are kept, so memory
+    is bounded however many users talk.
+    """
+
+    def __init__(self, max_tracked=MAX_TRACKED):
+        # Big enough to count repeats over REPEAT_WINDOW, and always at least one threshold's worth
+        size = max(FLOOD_THRESHOLD, REPEAT_THRESHOLD) * 4
+        self._authors = _LRU(max_tracked, lambda: _Ring(size))
+        self._channels = _LRU(max_tracked, lambda: _Ring(CHANNEL_THRESHOLD))
+        self._escalated = _LRU(max_tracked, lambda: 0.0)  # Map from author id to escalation expiry
+        self.escalations = 0
+        self.suppressed = 0  # Messages not scored because their author was escalated
+
+    def observe(self, ref, suspicious=True):
+        """
+        Records ref and returns its author's FloodStatus. Only suspicious
+        messages (ones the pre-filter would flag or escalate) count as repeats,
+        so saying "lol" a few times in a minute isn't a flood.
+        """
+        at = snowflake_time(ref.message_id)
+        digest = content_hash(ref.content) if suspicious else None
+        author = self._authors.touch(ref.author_id)
+        channel = self._channels.touch(ref.channel_id)
+        author.add(at, digest)
+        channel.add(at)
+
+        status = FloodStatus(
+            author.count_since(at - WINDOW),
+            author.count_since(at - REPEAT_WINDOW, digest) if suspicious else 0,
+            channel.count_since(at - WINDOW),
+        )
+        if self._escalated.get(ref.author_id, 0.0) > at:
+            status.escalated = True
+            status.reason = "already escalated"
+        elif status.messages >= FLOOD_THRESHOLD or status.repeats >= REPEAT_THRESHOLD:
+            status.escalated = status.newly_escalated = True
+            if status.messages >= FLOOD_THRESHOLD:
+                status.reason = f"{status.messages} messages in {WINDOW:.0f}s"
+            else:
+                status.reason = f"same message {status.repeats} times in {REPEAT_WINDOW:.0f}s"
+            self._escalated.touch(ref.author_id)
+            self._escalated[ref.author_id] = at + ESCALATION_TTL
+            self.escalations += 1
+        return status
@@ -0,0 +1,25 @@
+import asyncio
+
+
+class InFlight:
+    """
+    Shares one call per key between concurrent callers: a caller asking for a
+    key whose call is still running waits for that call instead of starting
+    another. The call is shielded, so one caller giving up (e.g. a cancelled
+    cascade stage) doesn't cancel it for the others; it still runs to the end.
+    """
+
+    def __init__(self):
+        self._futures = {}  # Map from key to the future of a call in progress
+        self.coalesced = 0  # Callers that joined a call already in flight
+
+    async def run(self, key, call):
+        # call is a coroutine function taking no arguments; only invoked if nothing is in flight for key
+        future = self._futures.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(call())
+            self._futures[key] = future
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        return await asyncio.shield(future)
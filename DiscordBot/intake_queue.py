@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from report import MessageRef
+
+log = logging.getLogger("modbot.intake")
+
+# Seconds from on_message to a worker picking the message up; replayed messages can be minutes old
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Rewrite the journal once this many acknowledged entries have piled up in it
+COMPACT_EVERY = 1000
+
+
+class IntakeQueue:
+    """
+    Bounded queue between on_message and the scorer workers. put() returns as
+    soon as the message is queued; it only waits when maxsize messages are
+    already waiting, which pushes back on intake instead of growing without
+    limit.
+
+    If journal_path is given, every queued message is appended to a JSONL
+    journal and acknowledged once a worker has finished with it. Messages
+    that were never acknowledged are queued again on the next start, so a
+    restart doesn't drop them. A message may be processed twice if the bot
+    stops mid-way through it, never zero times.
+
+    A handler that couldn't finish a message yet (e.g. no classifier was up)
+    returns True to hold it: it stays in the journal until release(ref).
+    """
+
+    def __init__(self, maxsize=1000, journal_path=None, workers=4):
+        self.maxsize = maxsize
+        self.journal_path = journal_path
+        self.workers = workers
+        self.lag = REGISTRY.register(
+            Histogram(
+                "modbot_intake_wait_seconds",
+                LAG_BUCKETS,
+                help="Time from on_message to a worker picking the message up",
+            )
+        )
+        self.process_time = REGISTRY.register(
+            Histogram(
+                "modbot_stage_seconds",
+                help="Latency of each pipeline stage",
+                labels={"stage": "process"},
+            )
+        )
+        self.processed = 0
+        self.failed = 0
+        REGISTRY.register(
+            Gauge("modbot_intake_depth", help="Messages waiting for a worker", fn=self.depth)
+        )
+        REGISTRY.register(
+            Gauge(
+                "modbot_intake_held",
+                help="Messages kept unacknowledged in the journal until they can be scored",
+                fn=lambda: len(self._held),
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_intake_processed_total",
+                help="Messages the workers finished",
+                fn=lambda: self.processed,
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_intake_failed_total",
+                help="Messages whose processing raised",
+                fn=lambda: self.failed,
+            )
+        )
+        self._queue = None  # Created in start() so it binds to the running loop
+        self._tasks = []
+        self._seq = itertools.count()
+        self._unacked = {}  # Map from seq to journal entry, for compaction
+        self._held = {}  # Map from message id to the journal entry of a held message
+        self._acked_since_compact = 0
+        self._journal = None
+        replay = self._load_journal() if journal_path else []
+        self._replay = replay
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else len(self._replay)
+
+    def _load_journal(self):
+        if not os.path.isfile(self.journal_path):
+            return []
+        entries = {}
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line half-written
+                    continue
+                if record["op"] == "put":
+                    entries[record["seq"]] = record
+                else:
+                    entries.pop(record["seq"], None)
+        return [entries[seq] for seq in sorted(entries)]
+
+    def _write(self, record):
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+
+    def _open_journal(self, pending):
+        # Start a fresh journal holding only what is still pending
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w") as f:
+            for record in pending:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a")
+        self._acked_since_compact = 0
+
+    async def start(self, handler):
+        """Replays journaled messages and starts the workers; handler is a coroutine function taking a MessageRef."""
+        self._queue = asyncio.Queue(self.maxsize)
+        replay, self._replay = self._replay, []
+        if self.journal_path:
+            # Renumber so sequence numbers keep increasing across restarts
+            for record in replay:
+                record["seq"] = next(self._seq)
+                self._unacked[record["seq"]] = record
+            self._open_journal(replay)
+        if replay:
+            log.info("Replaying %d unprocessed messages", len(replay))
+        self._tasks = [
+            asyncio.create_task(self._worker(handler)) for _ in range(self.workers)
+        ]
+        for record in replay:
+            await self._queue.put(record)
+
+    async def put(self, ref):
+        record = {
+            "op": "put",
+            "seq": next(self._seq),
+            "enqueued_at": time.time(),
+            "ref": ref.to_dict(),
+        }
+        if self._journal is not None:
+            self._unacked[record["seq"]] = record
+            self._write(record)
+        await self._queue.put(record)
+
+    def _ack(self, record):
+        if self._journal is None:
+            return
+        self._unacked.pop(record["seq"], None)
+        self._write({"op": "ack", "seq": record["seq"]})
+        self._acked_since_compact += 1
+        if self._acked_since_compact >= COMPACT_EVERY:
+            self._journal.close()
+            self._open_journal(sorted(self._unacked.values(), key=lambda r: r["seq"]))
+
+    def release(self, ref):
+        # Acknowledge a message the handler held on to, now that it is finished with
+        record = self._held.pop(ref.message_id, None)
+        if record is not None:
+            self._ack(record)
+
+    async def _worker(self, handler):
+        while True:
+            record = await self._queue.get()
+            self.lag.observe(max(time.time() - record["enqueued_at"], 0.0))
+            held = False
+            try:
+                with self.process_time.time():
+                    held = await handler(MessageRef.from_dict(record["ref"]))
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                message_id = record["ref"]["message_id"]
+                log.exception(
+                    "Processing message %s failed", message_id, extra={"message_id": message_id}
+                )
+            finally:
+                if held and self._journal is not None:
+                    self._held[record["ref"]["message_id"]] = record
+                else:
+                    self._ack(record)
+                self._queue.task_done()
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
@@ -0,0 +1,86 @@
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+# Level per subsystem; the gateway's DEBUG chatter is off unless asked for
+DEFAULT_LEVELS = {
+    "discord": "INFO",
+    "discord.http": "WARNING",
+    "discord.gateway": "WARNING",
+    "modbot": "INFO",
+}
+LOG_PATH = "discord.log"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+# Ids passed with extra={...} that are copied into the JSON record
+CONTEXT_FIELDS = ("message_id", "report_id", "guild_id", "channel_id", "author_id", "provider")
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with any CONTEXT_FIELDS the call passed in extra."""
+
+    def format(self, record):
+        data = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler formats each record before queueing it, which would put the
+    formatting cost back on the event loop. The queue never leaves this
+    process, so the record is queued as is and formatted on the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def parse_levels(specs):
+    # ["discord=DEBUG", "modbot.intake=WARNING"] -> {"discord": "DEBUG", "modbot.intake": "WARNING"}
+    levels = {}
+    for spec in specs or ():
+        name, _, level = spec.partition("=")
+        if not level or not isinstance(logging.getLevelName(level.upper()), int):
+            raise ValueError(f"Expected logger=LEVEL, got {spec!r}")
+        levels[name] = level.upper()
+    return levels
+
+
+def setup_logging(path=LOG_PATH, levels=None, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    """
+    Routes every logger through a queue to a size-rotated JSON log file written
+    on a background thread, so logging on the hot path costs one enqueue.
+    levels overrides DEFAULT_LEVELS per logger name. Returns the started
+    QueueListener; stop() it on shutdown to flush what is still queued.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+    )
+    file_handler.setFormatter(JSONFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_EnqueueHandler(log_queue))
+    root.setLevel(logging.WARNING)
+    for name, level in dict(DEFAULT_LEVELS, **(levels or {})).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    return listener
@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict
+
+import discord
+
+from inflight import InFlight
+from metrics import REGISTRY, Counter
+from report import MessageRef
+
+GUILD = "guild"
+CHANNEL = "channel"
+MESSAGE = "message"
+
+
+class MessageNotFound(LookupError):
+    def __init__(self, missing):
+        super().__init__(f"Unknown {missing}")
+        # Which part of the link couldn't be resolved: GUILD, CHANNEL or MESSAGE
+        self.missing = missing
+
+
+class MessageResolver:
+    """
+    Resolves (guild, channel, message) ids from a report link to a MessageRef.
+    Looks in, in order:
+
+    1. A bounded TTL cache of messages resolved recently (a pile-on reports the
+       same message many times).
+    2. discord.py's own cache of messages seen on the gateway.
+    3. channel.fetch_message(). Concurrent lookups of the same message share a
+       single request.
+
+    Cached entries are dropped when the message is edited or deleted.
+    """
+
+    def __init__(self, client, max_size=1024, ttl=10 * 60):
+        self.client = client
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # Map from (guild, channel, message) ids to (expires_at, MessageRef)
+        self._inflight = InFlight()
+        self.hits = 0  # Answered from our own cache
+        self.gateway_hits = 0  # Answered from discord.py's message cache
+        self.fetches = 0
+        for source, fn in (
+            ("cache", lambda: self.hits),
+            ("gateway", lambda: self.gateway_hits),
+            ("fetch", lambda: self.fetches),
+            ("coalesced", lambda: self._inflight.coalesced),
+        ):
+            REGISTRY.register(
+                Counter(
+                    "modbot_message_lookups_total",
+                    help="Report link lookups by where the message came from",
+                    labels={"source": source},
+                    fn=fn,
+                )
+            )
+
+    async def resolve(self, guild_id, channel_id, message_id):
+        key = (guild_id, channel_id, message_id)
+        entry = self._cache.get(key)
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._cache[key]
+
+        return await self._inflight.run(key, lambda: self._lookup(key))
+
+    async def _lookup(self, key):
+        ref = await self._find(*key)
+        self._store(key, ref)
+        return ref
+
+    async def _find(self, guild_id, channel_id, message_id):
+        guild = self.client.get_guild(guild_id)
+        if not guild:
+            raise MessageNotFound(GUILD)
+        channel = guild.get_channel(channel_id)
+        if not channel:
+            raise MessageNotFound(CHANNEL)
+        message = discord.utils.get(self.client.cached_messages, id=message_id)
+        if message is not None:
+            self.gateway_hits += 1
+            return MessageRef.from_message(message)
+        self.fetches += 1
+        try:
+            message = await channel.fetch_message(message_id)
+        except discord.errors.NotFound:
+            raise MessageNotFound(MESSAGE)
+        return MessageRef.from_message(message)
+
+    def _store(self, key, ref):
+        self._cache[key] = (time.monotonic() + self.ttl, ref)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def forget(self, guild_id, channel_id, message_id):
+        self._cache.pop((guild_id, channel_id, message_id), None)
@@ -0,0 +1,190 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger("modbot.metrics")
+
+# Latency buckets in seconds, from cache hits up to provider timeouts
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in sorted(labels.items())
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing count, optionally split by labels:
+    counter.inc(provider="google"). If fn is given, the value is read from it
+    instead, for counts another object already keeps (e.g. cache hits).
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help="", labels=None, fn=None):
+        self.name = name
+        self.help = help
+        # Labels every sample of this metric carries, e.g. {"stage": "prefilter"}
+        self.labels = dict(labels or {})
+        self.fn = fn
+        self._values = {}  # Map from sorted label items to value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        if self.fn is not None:
+            return self.fn()
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        # Yields (name, labels, value) in Prometheus text order
+        if self.fn is not None:
+            yield self.name, self.labels, self.fn()
+            return
+        if not self._values:
+            yield self.name, self.labels, 0
+        for key, value in self._values.items():
+            yield self.name, dict(self.labels, **dict(key)), value
+
+
+class Gauge(Counter):
+    """A value that can go up and down; set() it, or give fn to read it on scrape."""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and an increment."""
+
+    type = "histogram"
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = dict(labels or {})
+        self.buckets = tuple(buckets)
+        # One count per bucket upper bound, plus one for everything above the last bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        # Prometheus buckets are cumulative
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            yield self.name + "_bucket", dict(self.labels, le=_format_value(bound)), seen
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+
+class Registry:
+    """
+    Every metric the bot exports. Metrics sharing a name (e.g. one latency
+    histogram per stage, told apart by labels) are rendered as one family.
+    Registering a metric with the same name and labels as an existing one
+    replaces it.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # Map from (name, sorted labels) to metric
+
+    def register(self, metric):
+        self._metrics[(metric.name, tuple(sorted(metric.labels.items())))] = metric
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        families = {}
+        for metric in self._metrics.values():
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, metrics in families.items():
+            lines.append(f"# HELP {name} {metrics[0].help}")
+            lines.append(f"# TYPE {name} {metrics[0].type}")
+            for metric in metrics:
+                for sample, labels, value in metric.samples():
+                    lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# The bot's metrics; modules register theirs here when they're created
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """
+    Serves REGISTRY.render() at http://host:port/metrics for Prometheus to
+    scrape. A plain asyncio server on the bot's own loop, bound to localhost by
+    default.
+    """
+
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        log.info("Serving metrics on http://%s:%d/metrics", self.host, self.port)
+        return self
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers; nothing in them matters here
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+from eval_runner import TokenBucket
+from metrics import REGISTRY, Counter, Histogram
+
+log = logging.getLogger("modbot.dispatch")
+
+# Notice priorities; lower goes out first
+HIGH = 0  # Automatic reports and harm warnings
+NORMAL = 1  # Forwarded messages
+LOW = 2  # Routine score lines
+
+# Discord rejects messages longer than this
+MAX_MESSAGE_LENGTH = 2000
+# Discord allows about 5 messages per 5 seconds in one channel
+CHANNEL_RATE = 1.0
+CHANNEL_BURST = 5
+# How long to wait for more notices before sending a routine batch
+COALESCE_WINDOW = 0.5
+
+
+class ModNotice:
+    """The lines the bot posts about one message; sent together as one block."""
+
+    def __init__(self):
+        self.lines = []
+        self.priority = LOW
+
+    def add(self, text, priority=LOW):
+        self.lines.append(text)
+        self.priority = min(self.priority, priority)
+
+    def text(self):
+        return "\n".join(self.lines)
+
+
+class _Route:
+    def __init__(self, channel):
+        self.channel = channel
+        self.bucket = TokenBucket(CHANNEL_RATE, CHANNEL_BURST)
+        self.pending = []  # Heap of (priority, seq, text)
+        self.task = None
+        # Set when a HIGH notice arrives, to cut the coalescing wait short
+        self.urgent = asyncio.Event()
+
+
+def _chunks(text, limit=MAX_MESSAGE_LENGTH):
+    # Split an oversized block on line breaks where possible
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        yield text[:cut]
+        text = text[cut:].lstrip("\n")
+    if text:
+        yield text
+
+
+class ModChannelDispatcher:
+    """
+    Queues notices for mod channels and sends them in the background. Notices
+    that pile up within COALESCE_WINDOW are packed into as few Discord messages
+    as fit under the length limit, highest priority first. A high-priority
+    notice skips the window. Each channel has its own token bucket, sized to
+    stay under Discord's per-channel rate limit.
+    """
+
+    def __init__(self, window=COALESCE_WINDOW):
+        self.window = window
+        self._routes = {}  # Map from channel id to its _Route
+        self._seq = itertools.count()
+        self.notices = 0
+        self.messages_sent = 0
+        self.latency = REGISTRY.register(
+            Histogram(
+                "modbot_stage_seconds",
+                help="Latency of each pipeline stage",
+                labels={"stage": "mod_send"},
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_mod_notices_total",
+                help="Notices queued for mod channels",
+                fn=lambda: self.notices,
+            )
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_mod_messages_sent_total",
+                help="Discord messages sent to mod channels",
+                fn=lambda: self.messages_sent,
+            )
+        )
+
+    def send(self, channel, notice, priority=None):
+        # notice is a ModNotice or a plain string (sent at NORMAL priority unless given)
+        if isinstance(notice, ModNotice):
+            text, priority = notice.text(), notice.priority if priority is None else priority
+        else:
+            text, priority = notice, NORMAL if priority is None else priority
+        if not text:
+            return
+        route = self._routes.get(channel.id)
+        if route is None:
+            route = self._routes[channel.id] = _Route(channel)
+        heapq.heappush(route.pending, (priority, next(self._seq), text))
+        self.notices += 1
+        if priority == HIGH:
+            route.urgent.set()
+        if route.task is None or route.task.done():
+            route.task = asyncio.ensure_future(self._drain(route))
+
+    async def _drain(self, route):
+        while route.pending:
+            if route.pending[0][0] != HIGH:
+                # Wait for more notices to coalesce, unless a HIGH one turns up first
+                route.urgent.clear()
+                try:
+                    await asyncio.wait_for(route.urgent.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            await route.bucket.acquire_async()
+            batch = []
+            length = 0
+            while route.pending:
+                text = route.pending[0][2]
+                # Blank line between notices
+                added = len(text) + (2 if batch else 0)
+                if batch and length + added > MAX_MESSAGE_LENGTH:
+                    break
+                heapq.heappop(route.pending)
+                batch.append(text)
+                length += added
+            for i, chunk in enumerate(_chunks("\n\n".join(batch))):
+                if i:
+                    # Only a single oversized notice needs more than one message
+                    await route.bucket.acquire_async()
+                try:
+                    with self.latency.time():
+                        await route.channel.send(chunk)
+                    self.messages_sent += 1
+                except Exception:
+                    log.exception("Sending to mod channel %s failed", route.channel.id)
+
+    async def flush(self):
+        # Wait for everything queued so far to be sent
+        tasks = [route.task for route in self._routes.values() if route.task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from token_handler import credentials
+
+DISCOVERY_URL = "https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1"
+ANALYZE_URL = "https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze"
+CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "perspective_discovery.json"
+)
+# Refresh the cached discovery document once a week
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+class PerspectiveError(Exception):
+    # Raised by the plain HTTP backend; mirrors googleapiclient's HttpError.resp.status
+    def __init__(self, status, content):
+        super().__init__(f"Perspective request failed with {status}: {content}")
+        self.status = status
+
+
+def error_status(error):
+    # HTTP status of a failed Perspective call from either backend, or None
+    if isinstance(error, PerspectiveError):
+        return error.status
+    resp = getattr(error, "resp", None)
+    return getattr(resp, "status", None)
+
+
+def is_transient(error):
+    """
+    Whether a failed Perspective call is worth retrying: quota (429) and server
+    errors, timeouts and dropped connections. Other 4xx errors, such as
+    LANGUAGE_NOT_SUPPORTED_BY_ATTRIBUTE, fail the same way every time.
+    """
+    status = error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Socket timeouts, ConnectionError and requests' exceptions are all OSErrors; httplib2
+    # (under googleapiclient) reports DNS failures as its own ServerNotFoundError
+    return isinstance(error, OSError) or type(error).__name__ == "ServerNotFoundError"
+
+
+def load_discovery_document(path=CACHE_PATH, max_age=CACHE_MAX_AGE):
+    """
+    Returns the Perspective discovery document, fetching it only if the cached
+    copy on disk is missing or older than max_age. A stale copy is still used if
+    the fetch fails.
+    """
+    fresh = os.path.isfile(path) and time.time() - os.path.getmtime(path) < max_age
+    if not fresh:
+        try:
+            with urllib.request.urlopen(DISCOVERY_URL, timeout=10) as response:
+                document = response.read().decode("utf-8")
+            json.loads(document)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so another process never reads a half-written file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(document)
+            os.replace(tmp_path, path)
+            return document
+        except Exception:
+            if not os.path.isfile(path):
+                raise
+    with open(path) as f:
+        return f.read()
+
+
+class PerspectiveHTTPClient:
+    """Calls comments:analyze directly over a pooled requests.Session."""
+
+    def __init__(self, api_key, pool_size=10, timeout=10):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def analyze(self, body):
+        response = self.session.post(
+            ANALYZE_URL,
+            params={"key": self.api_key},
+            json=body,
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            raise PerspectiveError(response.status_code, response.text)
+        return response.json()
+
+
+class PerspectiveClient:
+    """
+    Lazily built Perspective client. Nothing touches the network until the first
+    analyze() call. backend is "discovery" (googleapiclient, built from the cached
+    discovery document) or "http" (PerspectiveHTTPClient).
+    """
+
+    def __init__(self, backend="discovery"):
+        if backend not in ("discovery", "http"):
+            raise ValueError(f"Unknown Perspective backend: {backend}")
+        self.backend = backend
+        # googleapiclient objects aren't thread-safe, so each thread gets its own
+        self._local = threading.local()
+        self._generation = 0
+        self._http = None
+        self._lock = threading.Lock()
+
+    def _discovery_client(self):
+        if getattr(self._local, "generation", None) != self._generation:
+            from googleapiclient import discovery
+
+            self._local.client = discovery.build_from_document(
+                load_discovery_document(), developerKey=credentials.get("google")
+            )
+            self._local.generation = self._generation
+        return self._local.client
+
+    def _http_client(self):
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    self._http = PerspectiveHTTPClient(credentials.get("google"))
+        return self._http
+
+    def analyze(self, body):
+        if self.backend == "http":
+            return self._http_client().analyze(body)
+        return self._discovery_client().comments().analyze(body=body).execute()
+
+    def reset(self, *args):
+        # Drop built clients so the next call picks up a rotated API key
+        self._generation += 1
+        self._http = None
@@ -0,0 +1,191 @@
+import json
+import math
+import os
+from collections import Counter, deque
+
+import metrics
+from score_cache import normalize_text
+
+SKIP = "skip"  # Benign: never sent to a paid classifier
+FLAG = "flag"  # Blocklist hit: reported without calling a classifier
+ESCALATE = "escalate"  # Undecided: score with the configured classifier
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TERMS_PATH = os.path.join(HERE, "prefilter_terms.json")
+# The local model is fit on FRENK's train split. The analysis scripts fit the Perspective
+# combiner on validation and evaluate on test (test_samples.csv), so none of those rows are seen.
+TRAINING_DATASET = ("classla/FRENK-hate-en", "multiclass")
+TRAINING_SPLIT = "train"
+
+# Messages shorter than this (after normalising) can't carry much meaning
+MIN_LENGTH = 3
+# Bits per character; "hahahaha" or "!!!!!!" fall below this
+MIN_ENTROPY = 1.5
+# Local model probability under which a message is skipped
+SKIP_BELOW = 0.1
+
+
+def shannon_entropy(text):
+    counts = Counter(text)
+    total = len(text)
+    return -sum(n / total * math.log2(n / total) for n in counts.values())
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+class AhoCorasick:
+    """
+    Matches every term of a word list against a message in a single pass, however
+    long the list. Only whole-word matches are reported, so "class" doesn't match
+    a blocked "ass".
+    """
+
+    def __init__(self, terms):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # Per node, the lengths of the terms ending there
+        for term in terms:
+            self._add(normalize_text(term))
+        self._build()
+
+    def _add(self, term):
+        if not term:
+            return
+        node = 0
+        for char in term:
+            if char not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[node][char] = len(self._goto) - 1
+            node = self._goto[node][char]
+        self._output[node].append(len(term))
+
+    def _build(self):
+        # Breadth-first, so every node's failure link points at an already finished node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def finditer(self, text):
+        # Yields (start, end) for each whole-word match in an already normalised text
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length in self._output[node]:
+                start, end = i + 1 - length, i + 1
+                if (start == 0 or not _is_word_char(text[start - 1])) and (
+                    end == len(text) or not _is_word_char(text[end])
+                ):
+                    yield start, end
+
+
+class Decision:
+    __slots__ = ("action", "reason")
+
+    def __init__(self, action, reason):
+        self.action = action
+        self.reason = reason
+
+
+class PreFilter:
+    """
+    Local checks run on every channel message before any network call:
+
+    1. Blocklist: any hit flags the message, unless it falls inside an allowed
+       phrase.
+    2. Length/entropy gate: very short, emoji-only or repetitive messages are skipped.
+    3. Allowlist: a message made up only of allowed phrases ("lol", "gg") is skipped.
+    4. Optional local model (TF-IDF + logistic regression): skips messages it is
+       confident are benign.
+
+    Anything else is escalated to the paid classifier.
+    """
+
+    def __init__(self, block=(), allow=(), skip_below=SKIP_BELOW):
+        self.block = AhoCorasick(block)
+        self.allow = AhoCorasick(allow)
+        self.skip_below = skip_below
+        self.model = None
+        self.latency = metrics.REGISTRY.register(
+            metrics.Histogram(
+                "modbot_stage_seconds",
+                help="Latency of each pipeline stage",
+                labels={"stage": "prefilter"},
+            )
+        )
+        self.decision_counter = metrics.REGISTRY.register(
+            metrics.Counter(
+                "modbot_prefilter_decisions_total", help="Pre-filter decisions by action"
+            )
+        )
+
+    @classmethod
+    def from_file(cls, path=TERMS_PATH, **kwargs):
+        with open(path) as f:
+            terms = json.load(f)
+        return cls(block=terms.get("block", ()), allow=terms.get("allow", ()), **kwargs)
+
+    def train_model(self):
+        # sklearn and datasets are only imported here so the bot starts without them
+        import datasets
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+
+        rows = datasets.load_dataset(*TRAINING_DATASET)[TRAINING_SPLIT]
+        texts = [normalize_text(text) for text in rows["text"]]
+        # Same target as the analysis scripts: FRENK labels 1 and 2 are harmful
+        labels = [int(label in (1, 2)) for label in rows["label"]]
+        model = make_pipeline(
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True),
+            LogisticRegression(class_weight="balanced", max_iter=1000),
+        )
+        model.fit(texts, labels)
+        self.model = model
+
+    def decide(self, text):
+        with self.latency.time():
+            decision = self._decide(normalize_text(text))
+        self.decision_counter.inc(action=decision.action)
+        return decision
+
+    def _decide(self, text):
+        covered = [False] * len(text)
+        for start, end in self.allow.finditer(text):
+            covered[start:end] = [True] * (end - start)
+        # Blocklist first, so a short or repetitive slur isn't waved through by the gate
+        for start, end in self.block.finditer(text):
+            if not all(covered[start:end]):
+                return Decision(FLAG, f'blocklist: "{text[start:end]}"')
+
+        if sum(1 for char in text if char.isalnum()) < MIN_LENGTH:
+            return Decision(SKIP, "too short")
+        if shannon_entropy(text) < MIN_ENTROPY:
+            return Decision(SKIP, "low entropy")
+        if all(covered[i] or not _is_word_char(char) for i, char in enumerate(text)):
+            return Decision(SKIP, "allowlisted")
+
+        score = self.model_score(text)
+        if score is not None:
+            if score < self.skip_below:
+                return Decision(SKIP, "local model")
+            return Decision(ESCALATE, "local model")
+        return Decision(ESCALATE, "no local verdict")
+
+    def model_score(self, text):
+        # Probability from the local model that text is harmful, or None without a model
+        if self.model is None:
+            return None
+        return float(self.model.predict_proba([normalize_text(text)])[0][1])
@@ -2,8 +2,10 @@ from enum import Enum, auto
 import discord
 import re
 import argparse
+import uuid
 
 from data_manager import DataManager
+from state_machine import ANY, StateMachine
 
 
 class State(Enum):
@@ -20,6 +22,105 @@ class State(Enum):
     REPORT_COMPLETE = auto()
 
 
+class MessageRef:
+    """
+    What a queued report keeps of the offending message: its ids and a text
+    snapshot, rather than the discord.Message with everything it references.
+    """
+
+    __slots__ = ("guild_id", "channel_id", "message_id", "author_id", "author_name", "content")
+
+    def __init__(self, guild_id, channel_id, message_id, author_id, author_name, content):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            message.guild.id if message.guild else None,
+            message.channel.id,
+            message.id,
+            message.author.id,
+            message.author.name,
+            message.content,
+        )
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*(data[slot] for slot in cls.__slots__))
+
+
+class ReportRecord:
+    """
+    A finished report waiting in the review queue. The five categories are
+    stored as a bitmask (bit i set means Report.categories[i] was True).
+    """
+
+    __slots__ = ("report_id", "reporter_id", "reporters", "category_mask", "score", "enqueued_at", "message",
+                 "members", "burst")
+
+    def __init__(self, reporter_id, message, category_mask=0, score=None, report_id=None, reporters=(),
+                 burst=None):
+        self.report_id = report_id or uuid.uuid4().hex
+        self.reporter_id = reporter_id
+        # Everyone else who reported the same message; their reports were merged into this one
+        self.reporters = list(reporters)
+        self.category_mask = category_mask
+        # Classifier score for automatic reports; used to prioritize the review queue
+        self.score = score
+        self.enqueued_at = None
+        self.message = message
+        # Reports of near-identical messages clustered under this one by the ReviewQueue.
+        # Not saved: each member is stored as its own row and clusters are rebuilt on restore.
+        self.members = []
+        # FloodStatus.to_dict() of the author's recent activity, for automatic reports
+        self.burst = burst
+
+    def has_category(self, category):
+        return bool(self.category_mask >> category & 1)
+
+    def all_reporters(self):
+        return [self.reporter_id] + self.reporters
+
+    def cluster(self):
+        return [self] + self.members
+
+    def to_dict(self):
+        data = {
+            "reporter_id": self.reporter_id,
+            "reporters": self.reporters,
+            "category_mask": self.category_mask,
+            "score": self.score,
+            "burst": self.burst,
+        }
+        data.update(self.message.to_dict())
+        return data
+
+    @classmethod
+    def from_dict(cls, data, report_id=None):
+        message = MessageRef.from_dict(data)
+        category_mask = data.get("category_mask")
+        if category_mask is None:
+            # Rows queued before the bitmask was introduced store the boolean list
+            category_mask = sum(1 << i for i, flagged in enumerate(data["categories"]) if flagged)
+        return cls(
+            data["reporter_id"],
+            message,
+            category_mask=category_mask,
+            score=data["score"],
+            report_id=report_id,
+            reporters=data.get("reporters", ()),
+            burst=data.get("burst"),
+        )
+
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
@@ -37,134 +138,127 @@ class Report:
     
     async def handle_message(self, message):
         '''
-        This function makes up the meat of the user-side reporting flow. It defines how we transition between states and what 
-        prompts to offer at each of those states. You're welcome to change anything you want; this skeleton is just here to
-        get you started and give you a model for working with Discord. 
+        This function makes up the meat of the user-side reporting flow. How we transition between states and what
+        prompts to offer at each of those states is declared in REPORT_FLOW below.
         '''
-        if message.content == self.CANCEL_KEYWORD:
-            self.state = State.REPORT_COMPLETE
-            self.cancelled = True
-            return ["Report cancelled."]
-        
-        if self.state == State.REPORT_START:
-            reply =  "Thank you for starting the reporting process. "
-            reply += "Say `help` at any time for more information.\n\n"
-            reply += "Please copy paste the link to the message you want to report.\n"
-            reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
-            self.state = State.AWAITING_MESSAGE
-            return [reply]
-        
-        if self.state == State.AWAITING_MESSAGE:
-            # Parse out the three ID strings from the message link
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
-            if not m:
-                return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
-            try:
-                message = await channel.fetch_message(int(m.group(3)))
-            except discord.errors.NotFound:
-                return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
-
-            # Here we've found the message
-            self.state = State.MESSAGE_IDENTIFIED
-            self.offending_message = message
-
-        if self.state == State.MESSAGE_IDENTIFIED:
-            self.state = State.USER_FIRST_PROMPT
-            return ["I found this message:", "```" + message.author.name + ": " + message.content + "```",
-                     "Why are you reporting this message? Please respond with the corresponding number. "
-                     "\n(1) Fraud\n(2) Verbal Abuse\n(3) Harassment/Threats of Violence"
-                     "\n(4) Sensitive/Disturbing Content\n(5) Other\n"]
-
-        if self.state == State.USER_FIRST_PROMPT:
-            # saves user making the report
-            self.reporter_id = message.author.id
-            if message.content == '1':
-                self.state = State.USER_FRAUD
-                self.categories[0] = True
-                return ["Select the type of harm. Please respond with the corresponding number. "
-                        "\n(1) Impersonation\n(2) Scam\n(3) Solicitation\n"]
-            if message.content == '2':
-                self.state = State.USER_VERBAL_ABUSE
-                self.categories[1] = True
-                reply = "Select the type of harm. Please respond with the corresponding number. \n"
-                reply += 'Violent language concerning...\n'
-                reply += "(1) Celebration of violent acts\n"
-                reply += "(2) Denial of a violent event\n"
-                reply += "(3) Dehumanization\n"
-                reply += "(4) Inciting or encouraging violence\n"
-                reply += 'Hate speech concerning...\n'
-                reply += "(5) Ethnicity/Race/Nationality\n"
-                reply += "(6) Gender/Sex/Sexuality\n"
-                reply += "(7) Religion\n"
-                reply += "(8) Disability/Health Status\n"
-                reply += "(9) Other\n"
-                return [reply] 
-            if message.content == '3':
-                self.state = State.USER_HARASSMENT
-                self.categories[2] = True
-                return ["Select the type of harm. Please respond with the corresponding number. "
-                        "\n(1) Sexual Harassment\n(2) Threatening to post or posting private info"
-                        "\n(3) Stalking or threats to injure\n"]
-            if message.content == '4':
-                self.state = State.USER_SENSITIVE_CONTENT
-                self.categories[3] = True
-                return ["Select the type of harm. Please respond with the corresponding number. "
-                        "\n(1) Child Exploitation\n(2) Assault\n(3) Beastiality\n(4) Self Harm\n"]
-            if message.content == '5':
-                self.state = State.USER_OTHER
-                self.categories[4] = True
-                return ["Why is this message harmful?"]
-
-            return ['Please select a valid option.']
-        
-        if self.state == State.USER_FRAUD and message.content in ('1', '2', '3'):
-            reply = 'Thank you for your report. Our 24/7 moderation team will review it shortly.\n'
-            reply += 'Would you like to block this user to prevent future interactions with them (yes/no)?\n'
-            self.state = State.USER_BLOCK
-            return [reply]
-        
-        if self.state == State.USER_VERBAL_ABUSE and message.content in ('1', '2', '3', '4', '5', '6', '7', '8', '9'):
-            reply = 'Thank you for your report. Our 24/7 moderation team will review it shortly.\n'
-            reply += 'Would you like to block this user to prevent future interactions with them (yes/no)?\n'
-            self.state = State.USER_BLOCK
-            return [reply]
-
-        if self.state == State.USER_HARASSMENT and message.content in ('1', '2', '3'):
-            reply = 'Thank you for your report. Our 24/7 moderation team will review it shortly.\n'
-            reply += 'Would you like to block this user to prevent future interactions with them (yes/no)?\n'
-            self.state = State.USER_BLOCK
-            return [reply]
-        
-        if self.state == State.USER_SENSITIVE_CONTENT and message.content in ('1', '2', '3', '4'):
-            reply = 'Thank you for your report. Our 24/7 moderation team will review it shortly.\n'
-            reply += 'Would you like to block this user to prevent future interactions with them (yes/no)?\n'
-            self.state = State.USER_BLOCK
-            return [reply]
-        
-        if self.state == State.USER_OTHER:
-            reply = 'Thank you for your report. Our 24/7 moderation team will review it shortly.\n'
-            reply += 'Would you like to block this user to prevent future interactions with them (yes/no)?\n'
-            self.state = State.USER_BLOCK
-            return [reply]
-        
-        if self.state == State.USER_BLOCK and message.content in ('yes', 'no'):
-            self.state = State.REPORT_COMPLETE
-            self.report_complete()
-            # client.add_user_report(message.author.id)
-            return ['Done. Report Closed.']
-
-        else:
-            return ['Invalid action. Please select only valid actions.']
+        return await REPORT_FLOW.dispatch(self, message)
+
+    async def find_message(self, message):
+        # Parse out the three ID strings from the message link
+        m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
+        if not m:
+            return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
+        try:
+            # A MessageRef, from the client's MessageResolver cache when possible
+            self.offending_message = await self.client.resolver.resolve(
+                int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except LookupError as e:
+            # message_resolver.MessageNotFound; missing is "guild", "channel" or "message"
+            return [NOT_FOUND_REPLIES[e.missing]]
 
     def report_complete(self):
         return self.state == State.REPORT_COMPLETE
-    
+
+    def to_queued(self):
+        # Compact form for the review queue; drops the client and the live message
+        category_mask = 0
+        for i, flagged in enumerate(self.categories):
+            if flagged:
+                category_mask |= 1 << i
+        return ReportRecord(
+            self.reporter_id,
+            self.offending_message,
+            category_mask=category_mask,
+        )
+
+
+NOT_FOUND_REPLIES = {
+    'guild': "I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again.",
+    'channel': "It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel.",
+    'message': "It seems this message was deleted or never existed. Please try again or say `cancel` to cancel.",
+}
+
+
+REPORT_THANKS = ('Thank you for your report. Our 24/7 moderation team will review it shortly.\n'
+                 'Would you like to block this user to prevent future interactions with them (yes/no)?\n')
+
+# (input, category index, state, prompt) for the first question of the user report flow
+REPORT_CATEGORIES = [
+    ('1', 0, State.USER_FRAUD,
+     "Select the type of harm. Please respond with the corresponding number. "
+     "\n(1) Impersonation\n(2) Scam\n(3) Solicitation\n"),
+    ('2', 1, State.USER_VERBAL_ABUSE,
+     "Select the type of harm. Please respond with the corresponding number. \n"
+     "Violent language concerning...\n"
+     "(1) Celebration of violent acts\n"
+     "(2) Denial of a violent event\n"
+     "(3) Dehumanization\n"
+     "(4) Inciting or encouraging violence\n"
+     "Hate speech concerning...\n"
+     "(5) Ethnicity/Race/Nationality\n"
+     "(6) Gender/Sex/Sexuality\n"
+     "(7) Religion\n"
+     "(8) Disability/Health Status\n"
+     "(9) Other\n"),
+    ('3', 2, State.USER_HARASSMENT,
+     "Select the type of harm. Please respond with the corresponding number. "
+     "\n(1) Sexual Harassment\n(2) Threatening to post or posting private info"
+     "\n(3) Stalking or threats to injure\n"),
+    ('4', 3, State.USER_SENSITIVE_CONTENT,
+     "Select the type of harm. Please respond with the corresponding number. "
+     "\n(1) Child Exploitation\n(2) Assault\n(3) Beastiality\n(4) Self Harm\n"),
+    ('5', 4, State.USER_OTHER, "Why is this message harmful?"),
+]
+
+
+def build_report_flow():
+    flow = StateMachine(State.REPORT_START, terminal=[State.REPORT_COMPLETE],
+                        invalid_reply=['Invalid action. Please select only valid actions.'])
+
+    async def cancel(report, message):
+        report.cancelled = True
+
+    flow.on_any_state(Report.CANCEL_KEYWORD, State.REPORT_COMPLETE, ["Report cancelled."], action=cancel)
+
+    reply = "Thank you for starting the reporting process. "
+    reply += "Say `help` at any time for more information.\n\n"
+    reply += "Please copy paste the link to the message you want to report.\n"
+    reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
+    flow.add(State.REPORT_START, ANY, State.AWAITING_MESSAGE, [reply])
+
+    flow.add(State.AWAITING_MESSAGE, ANY, State.MESSAGE_IDENTIFIED,
+             action=lambda report, message: report.find_message(message))
+    flow.on_enter(State.MESSAGE_IDENTIFIED, State.USER_FIRST_PROMPT, lambda report, message: [
+        "I found this message:",
+        "```" + report.offending_message.author_name + ": " + report.offending_message.content + "```",
+        "Why are you reporting this message? Please respond with the corresponding number. "
+        "\n(1) Fraud\n(2) Verbal Abuse\n(3) Harassment/Threats of Violence"
+        "\n(4) Sensitive/Disturbing Content\n(5) Other\n"])
+
+    async def save_reporter(report, message):
+        # saves user making the report
+        report.reporter_id = message.author.id
+
+    for choice, category, state, prompt in REPORT_CATEGORIES:
+        async def choose(report, message, category=category):
+            report.reporter_id = message.author.id
+            report.categories[category] = True
+        flow.add(State.USER_FIRST_PROMPT, choice, state, [prompt], action=choose)
+    flow.add(State.USER_FIRST_PROMPT, ANY, State.USER_FIRST_PROMPT, ['Please select a valid option.'],
+             action=save_reporter)
+
+    flow.add(State.USER_FRAUD, ('1', '2', '3'), State.USER_BLOCK, [REPORT_THANKS])
+    flow.add(State.USER_VERBAL_ABUSE, ('1', '2', '3', '4', '5', '6', '7', '8', '9'), State.USER_BLOCK, [REPORT_THANKS])
+    flow.add(State.USER_HARASSMENT, ('1', '2', '3'), State.USER_BLOCK, [REPORT_THANKS])
+    flow.add(State.USER_SENSITIVE_CONTENT, ('1', '2', '3', '4'), State.USER_BLOCK, [REPORT_THANKS])
+    flow.add(State.USER_OTHER, ANY, State.USER_BLOCK, [REPORT_THANKS])
+    flow.add(State.USER_BLOCK, ('yes', 'no'), State.REPORT_COMPLETE, ['Done. Report Closed.'])
+    return flow.validate(State)
+
+
+REPORT_FLOW = build_report_flow()
+
+
 class ReviewState(Enum):
     REVIEW_START = auto()
     REVIEW_FIRST_MESSAGE = auto()
@@ -173,7 +267,6 @@ class ReviewState(Enum):
     REVIEW_DISCRIMINATE_HIGH = auto()
     REVIEW_DISCRIMINATE_HARASSMENT = auto()
     REVIEW_DISCRIMINATE_SENSITIVE = auto()
-    REVIEW_HATE_SPEECH = auto()
     REVIEW_DEROGATORY = auto()
     REVIEW_SENSITIVE = auto()
     REVIEW_OTHER = auto()
@@ -191,7 +284,6 @@ class ReviewState(Enum):
     REVIEW_TIER_4 = auto()
     REVIEW_TIER_4_CSAM = auto()
     REVIEW_DISCRETIONARY = auto()
-    REVIEW_NO_ACTION = auto()
     REVIEW_CANNOT_REVIEW = auto()
     REVIEW_BOT = auto()
 
@@ -207,430 +299,54 @@ class Review:
         self.message = None
         self.noaction = False
         self.user_report_id = None
+        # The report being reviewed, taken off the ReviewQueue when a category is picked
+        self.report = None
         self.unreviewed = unreviewed
         self.data_manager = data_manager
     
     async def handle_message(self, message):
         '''
-        This function makes up the meat of the mod-side reporting flow. It defines how we transition between states and what
-        prompts to offer at each of those states.
+        This function makes up the meat of the mod-side reporting flow. How we transition between states and what
+        prompts to offer at each of those states is declared in REVIEW_FLOW below.
         '''
-
-        if message.content == self.CANCEL_KEYWORD:
-            self.state = ReviewState.REVIEW_CANCELLED
-            return ["Review cancelled."]
-        
-        if self.state == ReviewState.REVIEW_START:
-            reply = "Thank you for starting the review process. \n"
-            reply += "Which category would you like to review? \n"
-            reply += "\n(1) Fraud\n(2) Verbal Abuse\n(3) Harassment/Threats of Violence"
-            reply += "\n(4) Sensitive/Disturbing Content\n(5) Other\n(6) Automatic Reports"
-            self.state = ReviewState.REVIEW_FIRST_MESSAGE
-            return [reply]
-        
-        if self.state == ReviewState.REVIEW_FIRST_MESSAGE and message.content in ('1', '2', '3', '4', '5', '6'):
-            if message.content == '1':
-                # Make queue and get report
-                reports = {}
-                for author in self.unreviewed:
-                    for report in self.unreviewed[author]:
-                        if report.categories[0]:
-                            if author not in reports:
-                                reports[author] = []
-                            reports[author].append(report)
-                if not reports:
-                    self.state = ReviewState.REVIEW_CANNOT_REVIEW
-                    return ['No available unreviewed reports or reports in progress.']
-
-                self.user_report_id = list(reports.keys())[0]
-                report = self.unreviewed[self.user_report_id][0]
-                offending_message = report.offending_message
-                reporter = report.reporter_id
-                await message.channel.send('Below is the reported content:')
-                await message.channel.send("```" + offending_message.author.name + ": " + offending_message.content + "```")
-                await message.channel.send('Reporting User ' + str(reporter) + ' has made ' + str(self.data_manager.get_reports_confirmed(reporter))
-                                           + ' previous reports with ' + str(self.data_manager.get_trust_score(reporter)) + '% accuracy ')
-
-                reply = 'What is the type of fraud?\n'
-                reply += '(1) Impersonation\n'
-                reply += '(2) Scam\n'
-                reply += '(3) Solicitation\n'
-                reply += '(4) Not Violating\n'
-                self.state = ReviewState.REVIEW_FRAUD
-                return [reply]
-
-            if message.content == '2':
-                # Make queue and get report
-                reports = {}
-                for author in self.unreviewed:
-                    for report in self.unreviewed[author]:
-                        if report.categories[1]:
-                            if author not in reports:
-                                reports[author] = []
-                            reports[author].append(report)
-                if not reports:
-                    self.state = ReviewState.REVIEW_CANNOT_REVIEW
-                    return ['No available unreviewed reports or reports in progress.']
-
-                self.user_report_id = list(reports.keys())[0]
-                report = self.unreviewed[self.user_report_id][0]
-                offending_message = report.offending_message
-                reporter = report.reporter_id
-                await message.channel.send('Below is the reported content:')
-                await message.channel.send(
-                    "```" + offending_message.author.name + ": " + offending_message.content + "```")
-                await message.channel.send('Reporting User ' + str(reporter) + ' has made ' + str(
-                    self.data_manager.get_reports_confirmed(reporter))
-                                           + ' previous reports with ' + str(
-                    self.data_manager.get_trust_score(reporter)) + '% accuracy ')
-
-                reply = 'What is the type of verbal abuse? Please select the corresponding number.\n'
-                reply += '(1) Celebration of violent acts\n'
-                reply += '(2) Denial of a violent event\n'
-                reply += '(3) Dehumanization\n'
-                reply += '(4) Inciting or encouraging violence\n'
-                reply += '(5) Hate speech\n'
-                reply += '(6) Not Violating\n'
-                self.state = ReviewState.REVIEW_VERBAL_ABUSE
-                return [reply]
-
-            if message.content == '3':
-                # Make queue and get report
-                reports = {}
-                for author in self.unreviewed:
-                    for report in self.unreviewed[author]:
-                        if report.categories[2]:
-                            if author not in reports:
-                                reports[author] = []
-                            reports[author].append(report)
-                if not reports:
-                    print('not reports')
-                    self.state = ReviewState.REVIEW_CANNOT_REVIEW
-                    return ['No available unreviewed reports or reports in progress.']
-
-                self.user_report_id = list(reports.keys())[0]
-                report = self.unreviewed[self.user_report_id][0]
-                offending_message = report.offending_message
-                reporter = report.reporter_id
-                await message.channel.send('Below is the reported content:')
-                await message.channel.send(
-                    "```" + offending_message.author.name + ": " + offending_message.content + "```")
-                await message.channel.send('Reporting User ' + str(reporter) + ' has made ' + str(
-                    self.data_manager.get_reports_confirmed(reporter))
-                                           + ' previous reports with ' + str(
-                    self.data_manager.get_trust_score(reporter)) + '% accuracy ')
-
-                reply = 'What is the type of harassment or intimidation? Please select the corresponding number.\n'
-                reply += '(1) Threatening to post or posting private information\n'
-                reply += '(2) Sexual harassment\n'
-                reply += '(3) Stalking or threats to injure\n'
-                reply += '(4) Not Violating\n'
-                self.state = ReviewState.REVIEW_HARASSMENT
-                return [reply]
-
-            if message.content == '4':
-                # Make queue and get report
-                reports = {}
-                for author in self.unreviewed:
-                    for report in self.unreviewed[author]:
-                        if report.categories[3]:
-                            if author not in reports:
-                                reports[author] = []
-                            reports[author].append(report)
-                if not reports:
-                    self.state = ReviewState.REVIEW_CANNOT_REVIEW
-                    return ['No available unreviewed reports or reports in progress.']
-
-                self.user_report_id = list(reports.keys())[0]
-                report = self.unreviewed[self.user_report_id][0]
-                offending_message = report.offending_message
-                reporter = report.reporter_id
-                await message.channel.send('Below is the reported content:')
-                await message.channel.send("```" + offending_message.author.name + ": " + offending_message.content + "```")
-                await message.channel.send('Reporting User ' + str(reporter) + ' has made ' + str(self.data_manager.get_reports_confirmed(reporter))
-                                           + ' previous reports with ' + str(self.data_manager.get_trust_score(reporter)) + '% accuracy ')
-
-                reply = 'What is the type of sensitive or disturbing content? Please select the corresponding number.\n'
-                reply += '(1) Assault\n'
-                reply += '(2) Self harm\n'
-                reply += '(3) Beastiality\n'
-                reply += '(4) Child exploitation\n'
-                reply += '(5) Not Violating\n'
-                self.state = ReviewState.REVIEW_SENSITIVE
-                return reply
-
-            if message.content == '5':
-                # Make queue and get report
-                reports = {}
-                for author in self.unreviewed:
-                    for report in self.unreviewed[author]:
-                        if report.categories[4]:
-                            if author not in reports:
-                                reports[author] = []
-                            reports[author].append(report)
-                if not reports:
-                    self.state = ReviewState.REVIEW_CANNOT_REVIEW
-                    return ['No available unreviewed reports or reports in progress.']
-
-                self.user_report_id = list(reports.keys())[0]
-                report = self.unreviewed[self.user_report_id][0]
-                offending_message = report.offending_message
-                reporter = report.reporter_id
-                await message.channel.send('Below is the reported content:')
-                await message.channel.send("```" + offending_message.author.name + ": " + offending_message.content + "```")
-                await message.channel.send('Reporting User ' + str(reporter) + ' has made ' + str(self.data_manager.get_reports_confirmed(reporter))
-                                           + ' previous reports with ' + str(self.data_manager.get_trust_score(reporter)) + '% accuracy ')
-                self.state = ReviewState.REVIEW_OTHER
-                return ['Does the content fit into any other violative category (yes/no)?']
-
-            if message.content == '6':
-                # Make queue and get report
-                reports = {}
-                if 'BOT' in self.unreviewed:
-                    reports['BOT'] = self.unreviewed['BOT']
-                if not reports:
-                    self.state = ReviewState.REVIEW_CANNOT_REVIEW
-                    return ['No available unreviewed reports or reports in progress.']
-
-                self.user_report_id = list(reports.keys())[0]
-                report = self.unreviewed[self.user_report_id][0]
-                offending_message = report.offending_message
-                reporter = report.reporter_id
-                await message.channel.send('Below is the reported content:')
-                await message.channel.send(
-                    "```" + offending_message.author.name + ": " + offending_message.content + "```")
-                await message.channel.send('Reporting User ' + str(reporter) + ' has made ' + str(
-                    self.data_manager.get_reports_confirmed(reporter))
-                                           + ' previous reports with ' + str(
-                    self.data_manager.get_trust_score(reporter)) + '% accuracy ')
-                self.state = ReviewState.REVIEW_BOT
-                return ["What is the offense? Please respond with the corresponding number. "
-                        "\n(1) Fraud\n(2) Verbal Abuse\n(3) Harassment/Threats of Violence"
-                        "\n(4) Sensitive/Disturbing Content\n(5) Other\n(6) Non Violating\n"]
-
-            return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_BOT and message.content in ('1', '2', '3', '4', '5', '6'):
-            if message.content == '1':
-                reply = 'What is the type of fraud?\n'
-                reply += '(1) Impersonation\n'
-                reply += '(2) Scam\n'
-                reply += '(3) Solicitation\n'
-                self.state = ReviewState.REVIEW_FRAUD
-                return [reply]
-
-            if message.content == '2':
-                reply = 'What is the type of verbal abuse? Please select the corresponding number.\n'
-                reply += '(1) Celebration of violent acts\n'
-                reply += '(2) Denial of a violent event\n'
-                reply += '(3) Dehumanization\n'
-                reply += '(4) Inciting or encouraging violence\n'
-                reply += '(5) Hate speech'
-                self.state = ReviewState.REVIEW_VERBAL_ABUSE
-                return [reply]
-
-            if message.content == '3':
-                reply = 'What is the type of harassment or intimidation? Please select the corresponding number.\n'
-                reply += '(1) Threatening to post or posting private information\n'
-                reply += '(2) Sexual harassment\n'
-                reply += '(3) Stalking or threats to injure'
-                self.state = ReviewState.REVIEW_HARASSMENT
-                return [reply]
-
-            if message.content == '4':
-                reply = 'What is the type of sensitive or disturbing content? Please select the corresponding number.\n'
-                reply += '(1) Assault\n'
-                reply += '(2) Self harm\n'
-                reply += '(3) Beastiality\n'
-                reply += '(4) Child exploitation'
-                self.state = ReviewState.REVIEW_SENSITIVE
-                return reply
-
-            if message.content == '5':
-                self.state = ReviewState.REVIEW_OTHER
-                return ['Does the content fit into any other violative category (yes/no)?']
-
-            if message.content == '6':
-                self.state = ReviewState.REVIEW_TIER_0
-
-            return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_FRAUD:
-            if message.content == '4':
-                self.state = ReviewState.REVIEW_TIER_0
-            else:
-                self.state = ReviewState.REVIEW_TIER_1
-
-        if self.state == ReviewState.REVIEW_VERBAL_ABUSE:
-            if message.content in ('1', '2', '3'):
-                self.state = ReviewState.REVIEW_DISCRIMINATE_LOW
-                return ['Does it discriminate based on inherited attributes and/or feature hate speech (yes/no)?']
-            elif message.content == '4':
-                self.state = ReviewState.REVIEW_DISCRIMINATE_HIGH
-                return ['Does it discriminate based on inherited attributes and/or feature hate speech (yes/no)?']
-            elif message.content == '5':
-                self.state = ReviewState.REVIEW_INCITE_VIOLENCE
-                return ['Does it encourage, incite, or threaten violence (yes/no)?']
-            elif message.content == '6':
-                self.state = ReviewState.REVIEW_TIER_0
-
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_HARASSMENT:
-            if message.content == '1':
-                self.state = ReviewState.REVIEW_DISCRIMINATE_HARASSMENT
-                return ['Does it discriminate based on inherited attributes and/or feature hate speech (yes/no)?']
-            elif message.content in ('2', '3'):
-                self.state = ReviewState.REVIEW_TIER_3
-            elif message.content == '4':
-                self.state = ReviewState.REVIEW_TIER_0
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_SENSITIVE:
-            if message.content in ('1', '2'):
-                self.state = ReviewState.REVIEW_DISCRIMINATE_SENSITIVE
-            elif message.content in ('3', '4'):
-                self.state = ReviewState.REVIEW_TIER_4
-            elif message.content == '5':
-                self.state = ReviewState.REVIEW_TIER_0
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_OTHER and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_ABUSIVE
-                return ['Is the content abusive?']
-            elif message.content == 'yes':
-                reply = 'How would this abuse be categorized? Please select the corresponding number.\n'
-                reply += '(0) Tier 0: Not abusive\n'
-                reply += '(1) Tier 1: Low risk abuse\n'
-                reply += '(2) Tier 2: Medium risk abuse\n'
-                reply += '(3) Tier 3: High risk abuse\n'
-                reply += '(4) Tier 4: Illegal/immediate risk abuse\n'
-                reply += '(5) Tier 4: CSAM'
-                self.state = ReviewState.REVIEW_DISCRETIONARY
-                return [reply]
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DEFAMATION and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_DEROGATORY
-                return ['Does it contain derogatory slurs and other intentionally abuse '
-                        'language, including misgendering (yes/no)?']
-            elif message.content == 'yes':
-                self.state = ReviewState.REVIEW_TIER_3
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DEROGATORY and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_TIER_1
-            elif message.content == 'yes':
-                self.state = ReviewState.REVIEW_TIER_2
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_INCITE_VIOLENCE and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_DEFAMATION
-                return ['Does it involve defamation or the spreading of fear (yes/no)?']
-            elif message.content == 'yes':
-                self.state = ReviewState.REVIEW_TIER_4
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DISCRIMINATE_SENSITIVE and message.content in ('yes', 'no'):
-            if message.content == 'yes':
-                self.state = ReviewState.REVIEW_INCITE_VIOLENCE
-            elif message.content == 'no':
-                self.state = ReviewState.REVIEW_TIER_1
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DISCRIMINATE_HARASSMENT and message.content in ('yes', 'no'):
-            if message.content == 'yes':
-                self.state = ReviewState.REVIEW_INCITE_VIOLENCE
-            elif message.content == 'no':
-                self.state = ReviewState.REVIEW_TIER_3
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DISCRIMINATE_LOW and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_TIER_1
-            elif message.content == 'yes':
-                self.state = ReviewState.REVIEW_DEFAMATION
-                return ['Does it involve defamation or the spreading of fear (yes/no)?']
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DISCRIMINATE_HIGH and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_TIER_3
-            elif message.content == 'yes':
-                self.state = ReviewState.REVIEW_TIER_4
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_ABUSIVE and message.content in ('yes', 'no'):
-            if message.content == 'no':
-                self.state = ReviewState.REVIEW_TIER_0
-            elif message.content == 'yes':
-                self.state = ReviewState.REVIEW_TIER_1
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_DISCRETIONARY and message.content in ('0', '1', '2', '3', '4', '5'):
-            if message.content == '0':
-                self.state = ReviewState.REVIEW_TIER_0
-            if message.content == '1':
-                self.state = ReviewState.REVIEW_TIER_1
-            if message.content == '2':
-                self.state = ReviewState.REVIEW_TIER_2
-            if message.content == '3':
-                self.state = ReviewState.REVIEW_TIER_3
-            if message.content == '4':
-                self.state = ReviewState.REVIEW_TIER_4
-            if message.content == '5':
-                self.state = ReviewState.REVIEW_TIER_4_CSAM
-            else:
-                return ['Please select a valid option.']
-
-        if self.state == ReviewState.REVIEW_TIER_0:
-            self.state = ReviewState.REVIEW_COMPLETE
-            self.noaction = True
-            return ['Notified reporter that the behavior is not abusive. Provided them with an option to dispute.']
-
-        if self.state == ReviewState.REVIEW_TIER_1:
-            self.state = ReviewState.REVIEW_COMPLETE
-            return ["Removed content. Gave the offending user a warning."]
-
-        if self.state == ReviewState.REVIEW_TIER_2:
-            self.state = ReviewState.REVIEW_COMPLETE
-            return ["Removed content. Gave the offending user a one-day mute."]
-
-        if self.state == ReviewState.REVIEW_TIER_3:
-            self.state = ReviewState.REVIEW_COMPLETE
-            return ["Removed content. Gave the offending user a one-week mute."]
-
-        if self.state == ReviewState.REVIEW_TIER_4:
-            self.state = ReviewState.REVIEW_COMPLETE
-            return ["Removed content. Permanently banned the offending user. "
-                    "Stored content securely as required by law."]
-
-        if self.state == ReviewState.REVIEW_TIER_4_CSAM:
-            self.state = ReviewState.REVIEW_COMPLETE
-            return ["Removed content. Permanently banned the offending user. "
-                    "Stored content securely as required by law. Reported to NCMEC."]
-
-        if self.state == ReviewState.REVIEW_CANNOT_REVIEW:
-            return ['Review closed.']
-
-        else:
-            return ['Invalid action. Please select only valid actions.']
+        return await REVIEW_FLOW.dispatch(self, message)
+
+    async def take_report(self, message, category):
+        # Take the most urgent report in the chosen category off the queue
+        self.report = self.unreviewed.pop(category)
+        if self.report is None:
+            self.state = ReviewState.REVIEW_CANNOT_REVIEW
+            return ['No available unreviewed reports or reports in progress.']
+        self.user_report_id = self.report.reporter_id
+        await self.show_report(message.channel)
+
+    async def show_report(self, channel):
+        offending_message = self.report.message
+        reporter = self.report.reporter_id
+        await channel.send('Below is the reported content:')
+        await channel.send("```" + offending_message.author_name + ": " + offending_message.content + "```")
+        await channel.send('Reporting User ' + str(reporter) + ' has made ' + str(self.data_manager.get_reports_confirmed(reporter))
+                           + ' previous reports with ' + str(self.data_manager.get_trust_score(reporter)) + '% accuracy ')
+        if self.report.burst:
+            burst = self.report.burst
+            await channel.send('Recent activity: ' + offending_message.author_name + ' sent ' + str(burst['messages'])
+                               + ' message(s) in ' + str(int(burst['window'])) + 's and this text ' + str(burst['repeats'])
+                               + ' time(s) in ' + str(int(burst['repeat_window'])) + 's; the channel had '
+                               + str(burst['channel_messages']) + ' message(s) in the same ' + str(int(burst['window'])) + 's.'
+                               + (' Escalated: ' + burst['reason'] + '.' if burst['reason'] else ''))
+        if self.report.reporters:
+            await channel.send(str(len(self.report.reporters)) + ' other user(s) also reported this message.')
+        if self.report.members:
+            authors = {member.message.author_id for member in self.report.cluster()}
+            examples = "\n".join(member.message.author_name + ": " + member.message.content
+                                 for member in self.report.members[:3])
+            await channel.send(str(len(self.report.members)) + ' near-identical message(s) from ' + str(len(authors))
+                               + ' author(s) were reported too; your decision applies to all of them, e.g.\n'
+                               + "```" + examples + "```")
+        others = self.unreviewed.pending_for_author(offending_message.author_id)
+        if others:
+            await channel.send(offending_message.author_name + ' has ' + str(others)
+                               + ' other reported message(s) waiting for review.')
 
     def cannot_review(self):
         return self.state == ReviewState.REVIEW_CANNOT_REVIEW
@@ -640,3 +356,158 @@ class Review:
 
     def review_cancelled(self):
         return self.state == ReviewState.REVIEW_CANCELLED
+
+
+OTHER_QUESTION = 'Does the content fit into any other violative category (yes/no)?'
+DISCRIMINATE_QUESTION = 'Does it discriminate based on inherited attributes and/or feature hate speech (yes/no)?'
+
+# Yes/no questions asked on arriving at each state
+QUESTIONS = {
+    ReviewState.REVIEW_DISCRIMINATE_LOW: DISCRIMINATE_QUESTION,
+    ReviewState.REVIEW_DISCRIMINATE_HIGH: DISCRIMINATE_QUESTION,
+    ReviewState.REVIEW_DISCRIMINATE_HARASSMENT: DISCRIMINATE_QUESTION,
+    ReviewState.REVIEW_DISCRIMINATE_SENSITIVE: DISCRIMINATE_QUESTION,
+    ReviewState.REVIEW_INCITE_VIOLENCE: 'Does it encourage, incite, or threaten violence (yes/no)?',
+    ReviewState.REVIEW_DEFAMATION: 'Does it involve defamation or the spreading of fear (yes/no)?',
+    ReviewState.REVIEW_DEROGATORY: 'Does it contain derogatory slurs and other intentionally abuse '
+                                   'language, including misgendering (yes/no)?',
+    ReviewState.REVIEW_ABUSIVE: 'Is the content abusive?',
+}
+
+# (input, queue category, state, prompt) for the category menu. Automatic reports are
+# category 5 and first ask which kind of offense the bot caught.
+REVIEW_CATEGORIES = [
+    ('1', 0, ReviewState.REVIEW_FRAUD,
+     'What is the type of fraud?\n'
+     '(1) Impersonation\n'
+     '(2) Scam\n'
+     '(3) Solicitation\n'
+     '(4) Not Violating\n'),
+    ('2', 1, ReviewState.REVIEW_VERBAL_ABUSE,
+     'What is the type of verbal abuse? Please select the corresponding number.\n'
+     '(1) Celebration of violent acts\n'
+     '(2) Denial of a violent event\n'
+     '(3) Dehumanization\n'
+     '(4) Inciting or encouraging violence\n'
+     '(5) Hate speech\n'
+     '(6) Not Violating\n'),
+    ('3', 2, ReviewState.REVIEW_HARASSMENT,
+     'What is the type of harassment or intimidation? Please select the corresponding number.\n'
+     '(1) Threatening to post or posting private information\n'
+     '(2) Sexual harassment\n'
+     '(3) Stalking or threats to injure\n'
+     '(4) Not Violating\n'),
+    ('4', 3, ReviewState.REVIEW_SENSITIVE,
+     'What is the type of sensitive or disturbing content? Please select the corresponding number.\n'
+     '(1) Assault\n'
+     '(2) Self harm\n'
+     '(3) Beastiality\n'
+     '(4) Child exploitation\n'
+     '(5) Not Violating\n'),
+    ('5', 4, ReviewState.REVIEW_OTHER, OTHER_QUESTION),
+    ('6', 5, ReviewState.REVIEW_BOT,
+     "What is the offense? Please respond with the corresponding number. "
+     "\n(1) Fraud\n(2) Verbal Abuse\n(3) Harassment/Threats of Violence"
+     "\n(4) Sensitive/Disturbing Content\n(5) Other\n(6) Non Violating\n"),
+]
+
+# Outcome of each tier once a moderator has reached it
+TIER_OUTCOMES = [
+    (ReviewState.REVIEW_TIER_0, 'Notified reporter that the behavior is not abusive. Provided them with an option to dispute.'),
+    (ReviewState.REVIEW_TIER_1, "Removed content. Gave the offending user a warning."),
+    (ReviewState.REVIEW_TIER_2, "Removed content. Gave the offending user a one-day mute."),
+    (ReviewState.REVIEW_TIER_3, "Removed content. Gave the offending user a one-week mute."),
+    (ReviewState.REVIEW_TIER_4, "Removed content. Permanently banned the offending user. "
+                                "Stored content securely as required by law."),
+    (ReviewState.REVIEW_TIER_4_CSAM, "Removed content. Permanently banned the offending user. "
+                                     "Stored content securely as required by law. Reported to NCMEC."),
+]
+
+
+def build_review_flow():
+    S = ReviewState
+    flow = StateMachine(S.REVIEW_START, terminal=[S.REVIEW_COMPLETE, S.REVIEW_CANCELLED, S.REVIEW_CANNOT_REVIEW],
+                        invalid_reply=['Invalid action. Please select only valid actions.'])
+    flow.on_any_state(Review.CANCEL_KEYWORD, S.REVIEW_CANCELLED, ["Review cancelled."])
+    flow.on_invalid(S.REVIEW_CANNOT_REVIEW, ['Review closed.'])
+
+    reply = "Thank you for starting the review process. \n"
+    reply += "Which category would you like to review? \n"
+    reply += "\n(1) Fraud\n(2) Verbal Abuse\n(3) Harassment/Threats of Violence"
+    reply += "\n(4) Sensitive/Disturbing Content\n(5) Other\n(6) Automatic Reports"
+    flow.add(S.REVIEW_START, ANY, S.REVIEW_FIRST_MESSAGE, [reply])
+
+    prompts = {}
+    for choice, category, state, prompt in REVIEW_CATEGORIES:
+        prompts[state] = prompt
+        flow.add(S.REVIEW_FIRST_MESSAGE, choice, state, [prompt],
+                 action=lambda review, message, category=category: review.take_report(message, category),
+                 may_goto=[S.REVIEW_CANNOT_REVIEW])
+
+    # Automatic reports: the moderator first says which category the offense falls under
+    for choice, _, state, _ in REVIEW_CATEGORIES[:5]:
+        flow.add(S.REVIEW_BOT, choice, state, [prompts[state]])
+    flow.add(S.REVIEW_BOT, '6', S.REVIEW_TIER_0)
+
+    # Any answer other than "not violating" is a tier 1 fraud
+    flow.add(S.REVIEW_FRAUD, '4', S.REVIEW_TIER_0)
+    flow.add(S.REVIEW_FRAUD, ANY, S.REVIEW_TIER_1)
+
+    def goto(state, inputs, target):
+        question = QUESTIONS.get(target)
+        flow.add(state, inputs, target, [question] if question else None)
+
+    goto(S.REVIEW_VERBAL_ABUSE, ('1', '2', '3'), S.REVIEW_DISCRIMINATE_LOW)
+    goto(S.REVIEW_VERBAL_ABUSE, '4', S.REVIEW_DISCRIMINATE_HIGH)
+    goto(S.REVIEW_VERBAL_ABUSE, '5', S.REVIEW_INCITE_VIOLENCE)
+    goto(S.REVIEW_VERBAL_ABUSE, '6', S.REVIEW_TIER_0)
+    flow.on_invalid(S.REVIEW_VERBAL_ABUSE, ['Please select a valid option.'])
+
+    goto(S.REVIEW_HARASSMENT, '1', S.REVIEW_DISCRIMINATE_HARASSMENT)
+    goto(S.REVIEW_HARASSMENT, ('2', '3'), S.REVIEW_TIER_3)
+    goto(S.REVIEW_HARASSMENT, '4', S.REVIEW_TIER_0)
+    flow.on_invalid(S.REVIEW_HARASSMENT, ['Please select a valid option.'])
+
+    goto(S.REVIEW_SENSITIVE, ('1', '2'), S.REVIEW_DISCRIMINATE_SENSITIVE)
+    goto(S.REVIEW_SENSITIVE, ('3', '4'), S.REVIEW_TIER_4)
+    goto(S.REVIEW_SENSITIVE, '5', S.REVIEW_TIER_0)
+    flow.on_invalid(S.REVIEW_SENSITIVE, ['Please select a valid option.'])
+
+    tiers = 'How would this abuse be categorized? Please select the corresponding number.\n'
+    tiers += '(0) Tier 0: Not abusive\n'
+    tiers += '(1) Tier 1: Low risk abuse\n'
+    tiers += '(2) Tier 2: Medium risk abuse\n'
+    tiers += '(3) Tier 3: High risk abuse\n'
+    tiers += '(4) Tier 4: Illegal/immediate risk abuse\n'
+    tiers += '(5) Tier 4: CSAM'
+    goto(S.REVIEW_OTHER, 'no', S.REVIEW_ABUSIVE)
+    flow.add(S.REVIEW_OTHER, 'yes', S.REVIEW_DISCRETIONARY, [tiers])
+
+    # Yes/no questions: (state, next state on yes, next state on no)
+    for state, yes, no in [
+        (S.REVIEW_DEFAMATION, S.REVIEW_TIER_3, S.REVIEW_DEROGATORY),
+        (S.REVIEW_DEROGATORY, S.REVIEW_TIER_2, S.REVIEW_TIER_1),
+        (S.REVIEW_INCITE_VIOLENCE, S.REVIEW_TIER_4, S.REVIEW_DEFAMATION),
+        (S.REVIEW_DISCRIMINATE_SENSITIVE, S.REVIEW_INCITE_VIOLENCE, S.REVIEW_TIER_1),
+        (S.REVIEW_DISCRIMINATE_HARASSMENT, S.REVIEW_INCITE_VIOLENCE, S.REVIEW_TIER_3),
+        (S.REVIEW_DISCRIMINATE_LOW, S.REVIEW_DEFAMATION, S.REVIEW_TIER_1),
+        (S.REVIEW_DISCRIMINATE_HIGH, S.REVIEW_TIER_4, S.REVIEW_TIER_3),
+        (S.REVIEW_ABUSIVE, S.REVIEW_TIER_1, S.REVIEW_TIER_0),
+    ]:
+        goto(state, 'yes', yes)
+        goto(state, 'no', no)
+
+    for choice, (state, _) in zip(('0', '1', '2', '3', '4', '5'), TIER_OUTCOMES):
+        flow.add(S.REVIEW_DISCRETIONARY, choice, state)
+
+    # Reaching a tier finishes the review right away
+    async def no_action(review, message):
+        review.noaction = True
+
+    for state, outcome in TIER_OUTCOMES:
+        flow.on_enter(state, S.REVIEW_COMPLETE, [outcome],
+                      action=no_action if state == S.REVIEW_TIER_0 else None)
+    return flow.validate(ReviewState)
+
+
+REVIEW_FLOW = build_review_flow()
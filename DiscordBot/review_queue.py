@@ -0,0 +1,229 @@
+import heapq
+import itertools
+import time
+from collections import Counter
+
+from fingerprint import ClusterIndex, Fingerprint
+from report import ReportRecord
+
+# Categories match Report.categories; automatic (bot-filed) reports get their own
+FRAUD, VERBAL_ABUSE, HARASSMENT, SENSITIVE_CONTENT, OTHER, AUTOMATIC = range(6)
+CATEGORIES = (FRAUD, VERBAL_ABUSE, HARASSMENT, SENSITIVE_CONTENT, OTHER, AUTOMATIC)
+
+# How harmful a report in each category is likely to be when no classifier score is attached
+CATEGORY_SEVERITY = {
+    FRAUD: 0.5,
+    VERBAL_ABUSE: 0.6,
+    HARASSMENT: 0.8,
+    SENSITIVE_CONTENT: 0.9,
+    OTHER: 0.3,
+    AUTOMATIC: 0.5,
+}
+
+# Priority = severity * SEVERITY_WEIGHT + trust * TRUST_WEIGHT + hours waiting * AGE_WEIGHT
+#            + extra reporters * REPORTER_WEIGHT
+SEVERITY_WEIGHT = 1.0
+TRUST_WEIGHT = 0.5
+AGE_WEIGHT = 0.25
+# Added per extra user who reported the same message
+REPORTER_WEIGHT = 0.1
+
+
+def report_categories(report):
+    # Categories of a report and of every member of its cluster
+    cluster = report.cluster()
+    categories = [c for c in CATEGORIES if any(r.has_category(c) for r in cluster)]
+    # A user report merged into an automatic one (or the reverse) is listed under both
+    if any("BOT" in r.all_reporters() for r in cluster):
+        categories.append(AUTOMATIC)
+    return categories
+
+
+class _Entry:
+    __slots__ = ("key", "seq", "report", "removed")
+
+    def __init__(self, key, seq, report):
+        self.key = key
+        self.seq = seq
+        self.report = report
+        self.removed = False
+
+    def __lt__(self, other):
+        return (self.key, self.seq) < (other.key, other.seq)
+
+
+class ReviewQueue:
+    """
+    Pending reports, indexed by category, each category kept as a heap ordered by
+    priority. Every report waits the same amount longer as time passes, so the age
+    term can be folded into a fixed key at push time: the most urgent report is
+    always at the top of its heap (O(1) peek, O(log n) pop).
+
+    A report flagged under several categories sits in each of their heaps; popping
+    it from one marks it removed and the others drop it lazily.
+
+    Reports of a message that is already waiting are merged into the waiting
+    report, so a pile-on is one review item rather than one per reporter.
+    Reports of a different message with the same or nearly the same text (see
+    fingerprint.py) join the waiting report's cluster as members: the cluster
+    is reviewed once and the decision covers every member.
+    """
+
+    def __init__(self, data_manager, store=None):
+        self.data_manager = data_manager
+        # Optional SQLiteStore; queued reports are written through so they survive a restart
+        self.store = store
+        self._heaps = {category: [] for category in CATEGORIES}
+        self._entries = {}  # Map from report_id to its live entry
+        self._by_message = {}  # Map from offending message id to the live entry reporting it
+        self._clusters = ClusterIndex()  # Finds the waiting cluster head a report's text belongs to
+        self._authors = Counter()  # Map from offending author id to pending reports of their messages
+        self._seq = itertools.count()
+
+    def priority(self, report, enqueued_at):
+        cluster = report.cluster()
+        scores = [r.score for r in cluster if r.score is not None]
+        if scores:
+            severity = max(scores)
+        else:
+            severity = max(CATEGORY_SEVERITY[c] for c in report_categories(report))
+        trust = self.data_manager.get_trust_score(report.reporter_id) / 100
+        extra_reports = sum(len(r.all_reporters()) for r in cluster) - 1
+        # Older reports are more urgent; subtracting enqueue time keeps the key fixed
+        return (
+            severity * SEVERITY_WEIGHT
+            + trust * TRUST_WEIGHT
+            + extra_reports * REPORTER_WEIGHT
+            - enqueued_at / 3600 * AGE_WEIGHT
+        )
+
+    def push(self, report, enqueued_at=None):
+        if enqueued_at is None:
+            enqueued_at = time.time()
+        saved, dropped_id = self._add(report, enqueued_at)
+        if self.store is not None:
+            self.store.save_report(saved.report_id, saved.enqueued_at, saved.to_dict())
+            if dropped_id is not None:
+                self.store.delete_report(dropped_id)
+
+    def _add(self, report, enqueued_at):
+        # Returns the record to write to the store, and the id of a row it replaces (or None)
+        existing = self._by_message.get(report.message.message_id)
+        if existing is not None:
+            for member in report.members:
+                self._authors[member.message.author_id] += 1
+            target = self._merge(existing, report, enqueued_at)
+            return target, report.report_id if report.report_id != target.report_id else None
+
+        report.enqueued_at = enqueued_at
+        for member in report.cluster():
+            self._authors[member.message.author_id] += 1
+        head = self._clusters.find(Fingerprint(report.message.content))
+        if head is not None:
+            self._join(self._entries[head.report_id], report)
+        else:
+            self._insert(report, enqueued_at)
+            for member in report.cluster():
+                self._clusters.add(Fingerprint(member.message.content), report)
+        return report, None
+
+    def _merge(self, entry, report, enqueued_at):
+        # Another report of a message that is already waiting, alone or in a cluster
+        target = entry.report
+        for member in target.cluster():
+            if member.message.message_id == report.message.message_id:
+                break
+        member.category_mask |= report.category_mask
+        for reporter in report.all_reporters():
+            if reporter not in member.all_reporters():
+                member.reporters.append(reporter)
+        if report.score is not None and (member.score is None or report.score > member.score):
+            member.score = report.score
+        member.enqueued_at = min(member.enqueued_at, enqueued_at)
+        # A requeued cluster brings its members along
+        self._absorb(target, report.members)
+        report.members = []
+        # Categories and priority may have changed, so re-insert; the earlier report keeps its place
+        entry.removed = True
+        self._insert(target, min(target.enqueued_at, enqueued_at))
+        return member
+
+    def _join(self, entry, report):
+        self._absorb(entry.report, [report] + report.members)
+        report.members = []
+        entry.removed = True
+        self._insert(entry.report, entry.report.enqueued_at)
+
+    def _absorb(self, head, reports):
+        for report in reports:
+            head.members.append(report)
+            self._clusters.add(Fingerprint(report.message.content), head)
+
+    def _insert(self, report, enqueued_at):
+        report.enqueued_at = enqueued_at
+        # heapq is a min-heap, so store the negated priority
+        entry = _Entry(-self.priority(report, enqueued_at), next(self._seq), report)
+        self._entries[report.report_id] = entry
+        for member in report.cluster():
+            self._by_message[member.message.message_id] = entry
+        for category in report_categories(report):
+            heapq.heappush(self._heaps[category], entry)
+
+    def restore(self):
+        # Re-queue reports saved by a previous run
+        if self.store is None:
+            return
+        for report_id, enqueued_at, data in self.store.load_reports():
+            # Clusters are rebuilt as the saved reports are added back in order
+            self._add(ReportRecord.from_dict(data, report_id=report_id), enqueued_at)
+
+    def _top(self, category):
+        heap = self._heaps[category]
+        while heap and heap[0].removed:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def peek(self, category):
+        entry = self._top(category)
+        return entry.report if entry else None
+
+    def pop(self, category):
+        # Take the most urgent report so no other moderator picks it up.
+        # It stays in the store until remove() is called once the review is done.
+        entry = self._top(category)
+        if entry is None:
+            return None
+        heapq.heappop(self._heaps[category])
+        self._forget(entry)
+        return entry.report
+
+    def requeue(self, report):
+        # Put back a report whose review was cancelled, keeping its place in line
+        self.push(report, enqueued_at=report.enqueued_at)
+
+    def remove(self, report):
+        # Done with a reviewed report and every member of its cluster
+        entry = self._entries.get(report.report_id)
+        if entry is not None:
+            self._forget(entry)
+        if self.store is not None:
+            for member in report.cluster():
+                self.store.delete_report(member.report_id)
+
+    def _forget(self, entry):
+        entry.removed = True
+        self._entries.pop(entry.report.report_id, None)
+        self._clusters.remove(entry.report)
+        for member in entry.report.cluster():
+            if self._by_message.get(member.message.message_id) is entry:
+                del self._by_message[member.message.message_id]
+            self._authors[member.message.author_id] -= 1
+            if not self._authors[member.message.author_id]:
+                del self._authors[member.message.author_id]
+
+    def pending_for_author(self, author_id):
+        # Reports waiting (in any cluster) about messages by this author
+        return self._authors.get(author_id, 0)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+
+from inflight import InFlight
+from metrics import REGISTRY, Counter, Gauge
+
+
+def normalize_text(text):
+    # Copypasta often differs only in case, spacing or unicode lookalikes
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.casefold().split())
+
+
+class ScoreCache:
+    """
+    LRU cache of classifier outputs keyed by provider and a hash of the normalized
+    message text. Entries expire after ttl seconds. If path is given, entries are
+    also written to a SQLite file so the cache survives restarts.
+    """
+
+    def __init__(self, max_size=10000, ttl=6 * 60 * 60, path=None, flush_every=50):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # Map from key to (expires_at, value)
+        self._db = None
+        self._unflushed = []
+        self.flush_every = flush_every
+        REGISTRY.register(
+            Counter("modbot_score_cache_hits_total", help="Score cache hits", fn=lambda: self.hits)
+        )
+        REGISTRY.register(
+            Counter(
+                "modbot_score_cache_misses_total", help="Score cache misses", fn=lambda: self.misses
+            )
+        )
+        REGISTRY.register(
+            Gauge(
+                "modbot_score_cache_entries",
+                help="Entries in the in-memory score cache",
+                fn=lambda: len(self._entries),
+            )
+        )
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)"
+            )
+            self._db.execute("DELETE FROM scores WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(provider, text):
+        digest = hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{provider}:{digest}"
+
+    def get(self, provider, text):
+        key = self.make_key(provider, text)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT expires_at, value FROM scores WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                entry = (row[0], json.loads(row[1]))
+                self._store(key, entry)
+        if entry is None or entry[0] < now:
+            if entry is not None:
+                self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, provider, text, value):
+        key = self.make_key(provider, text)
+        expires_at = time.time() + self.ttl
+        self._store(key, (expires_at, value))
+        if self._db is not None:
+            self._unflushed.append((key, expires_at, json.dumps(value)))
+            if len(self._unflushed) >= self.flush_every:
+                self.flush()
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def flush(self):
+        if self._db is None or not self._unflushed:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?)", self._unflushed
+            )
+        self._unflushed = []
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CachedClassifier:
+    """
+    Checks the score cache before calling through to a provider. Lookups for
+    the same (normalized) text that arrive while a call is already in flight
+    wait for that call instead of paying for another one.
+    """
+
+    def __init__(self, name, classifier, cache):
+        self.name = name
+        self.classifier = classifier
+        self.cache = cache
+        self._inflight = InFlight()
+        REGISTRY.register(
+            Counter(
+                "modbot_score_cache_coalesced_total",
+                help="Lookups that waited for a call already in flight for the same text",
+                labels={"provider": name},
+                fn=lambda: self._inflight.coalesced,
+            )
+        )
+
+    async def __call__(self, text):
+        cached = self.cache.get(self.name, text)
+        if cached is not None:
+            return cached
+        key = ScoreCache.make_key(self.name, text)
+        return await self._inflight.run(key, lambda: self._call(text))
+
+    async def _call(self, text):
+        result = await self.classifier(text)
+        self.cache.set(self.name, text, result)
+        return result
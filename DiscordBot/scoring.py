@@ -0,0 +1,100 @@
+import json
+import os
+
+import numpy as np
+
+from metrics import REGISTRY, Histogram
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+MODEL_FORMAT = 1
+
+# Time to turn one message's provider output into a probability
+SCORE_LATENCY = REGISTRY.register(
+    Histogram(
+        "modbot_stage_seconds",
+        help="Latency of each pipeline stage",
+        labels={"stage": "scoring"},
+    )
+)
+
+
+def stable_sigmoid(x):
+    # Split on sign so np.exp never sees a large positive argument and overflows
+    x = np.asarray(x, dtype=float)
+    out = np.empty_like(x)
+    positive = x >= 0
+    out[positive] = 1 / (1 + np.exp(-x[positive]))
+    exp_x = np.exp(x[~positive])
+    out[~positive] = exp_x / (1 + exp_x)
+    return out
+
+
+def model_path(name):
+    return os.path.join(MODEL_DIR, f"{name}.json")
+
+
+class LogisticModel:
+    """
+    Logistic regression over classifier attribute scores (e.g. Perspective's
+    INSULT/THREAT or OpenAI's hate/violence). Coefficients are stored in a
+    versioned JSON file under models/ that the training scripts write.
+    """
+
+    def __init__(self, name, features, coef, intercept, version=1):
+        self.name = name
+        self.features = list(features)
+        self.coef = np.asarray(coef, dtype=float)
+        self.intercept = float(intercept)
+        self.version = version
+        self._index = {feature: i for i, feature in enumerate(self.features)}
+
+    @classmethod
+    def load(cls, name):
+        with open(model_path(name)) as f:
+            data = json.load(f)
+        if data.get("format") != MODEL_FORMAT:
+            raise Exception(f"Unsupported model file format for {name}: {data.get('format')}")
+        return cls(
+            data["name"],
+            data["features"],
+            data["coef"],
+            data["intercept"],
+            version=data["version"],
+        )
+
+    @classmethod
+    def from_sklearn(cls, name, clf, features):
+        # Bump the version of whatever model is currently saved under this name
+        version = 1
+        if os.path.isfile(model_path(name)):
+            version = cls.load(name).version + 1
+        return cls(name, features, clf.coef_[0], clf.intercept_[0], version=version)
+
+    def save(self):
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        data = {
+            "format": MODEL_FORMAT,
+            "name": self.name,
+            "version": self.version,
+            "features": self.features,
+            "coef": self.coef.tolist(),
+            "intercept": self.intercept,
+        }
+        with open(model_path(self.name), "w") as f:
+            json.dump(data, f, indent=4)
+
+    def vectorize(self, outputs):
+        # Attributes a provider didn't return (e.g. unsupported language) count as 0
+        X = np.zeros((len(outputs), len(self.features)))
+        for row, scores in enumerate(outputs):
+            for key, value in scores.items():
+                if key in self._index:
+                    X[row, self._index[key]] = value
+        return X
+
+    def predict_proba(self, outputs):
+        return stable_sigmoid(self.vectorize(outputs) @ self.coef + self.intercept)
+
+    def score(self, scores):
+        with SCORE_LATENCY.time():
+            return float(self.predict_proba([scores])[0])
@@ -0,0 +1,114 @@
+# Matches any input for a state that has no more specific transition
+ANY = object()
+
+
+class Transition:
+    __slots__ = ("target", "reply", "action", "may_goto")
+
+    def __init__(self, target, reply=None, action=None, may_goto=()):
+        self.target = target
+        # A list of strings, or a function (flow, message) -> list of strings
+        self.reply = reply
+        # Optional coroutine (flow, message) run before moving. If it returns a list of
+        # replies the transition is abandoned and those are sent instead; the action may
+        # also have moved the flow to one of the states listed in may_goto.
+        self.action = action
+        self.may_goto = tuple(may_goto)
+
+
+class InvalidStateMachine(Exception):
+    pass
+
+
+class StateMachine:
+    """
+    Declarative transition table for a conversational flow. Each incoming message is
+    dispatched with one dict lookup on (state, message.content), falling back to
+    (state, ANY). Some states are pass-through: entering them immediately takes
+    their on_enter transition (e.g. a decided tier completes the review).
+    """
+
+    def __init__(self, start, terminal, invalid_reply):
+        self.start = start
+        self.terminal = set(terminal)
+        self.invalid_reply = invalid_reply
+        self.transitions = {}  # Map from (state, input) to Transition
+        self.entered = {}  # Map from pass-through state to the Transition taken on entry
+        self.global_transitions = {}  # Map from input to Transition, valid in every state
+        self.invalid_replies = {}  # Map from state to its reply for unexpected input
+
+    def add(self, state, inputs, target, reply=None, action=None, may_goto=()):
+        transition = Transition(target, reply, action, may_goto)
+        if inputs is ANY or isinstance(inputs, str):
+            inputs = [inputs]
+        for value in inputs:
+            self.transitions[(state, value)] = transition
+
+    def on_enter(self, state, target, reply=None, action=None):
+        self.entered[state] = Transition(target, reply, action)
+
+    def on_any_state(self, value, target, reply=None, action=None):
+        self.global_transitions[value] = Transition(target, reply, action)
+
+    def on_invalid(self, state, reply):
+        self.invalid_replies[state] = reply
+
+    def _edges(self):
+        edges = {}
+        for (state, _), transition in self.transitions.items():
+            edges.setdefault(state, set()).update((transition.target,) + transition.may_goto)
+        for state, transition in self.entered.items():
+            edges.setdefault(state, set()).add(transition.target)
+        return edges
+
+    def validate(self, states):
+        """
+        Checks the table when it is built: every state is reachable from the start,
+        terminal states have no outgoing transitions, and every other reachable state
+        has at least one.
+        """
+        edges = self._edges()
+        reachable = {self.start}
+        reachable.update(t.target for t in self.global_transitions.values())
+        frontier = list(reachable)
+        while frontier:
+            for target in edges.get(frontier.pop(), ()):
+                if target not in reachable:
+                    reachable.add(target)
+                    frontier.append(target)
+
+        unreachable = set(states) - reachable
+        if unreachable:
+            raise InvalidStateMachine(f"Unreachable states: {sorted(s.name for s in unreachable)}")
+        for state in reachable:
+            if state in self.terminal and state in edges:
+                raise InvalidStateMachine(f"Terminal state {state.name} has outgoing transitions")
+            if state not in self.terminal and state not in edges:
+                raise InvalidStateMachine(f"State {state.name} is a dead end")
+        return self
+
+    async def dispatch(self, flow, message):
+        content = message.content
+        transition = self.global_transitions.get(content)
+        if transition is None:
+            transition = self.transitions.get((flow.state, content))
+        if transition is None:
+            transition = self.transitions.get((flow.state, ANY))
+        if transition is None:
+            return list(self.invalid_replies.get(flow.state, self.invalid_reply))
+        return await self._take(flow, message, transition)
+
+    async def _take(self, flow, message, transition):
+        if transition.action is not None:
+            replies = await transition.action(flow, message)
+            if replies is not None:
+                return replies
+        flow.state = transition.target
+        replies = transition.reply or []
+        if callable(replies):
+            replies = replies(flow, message)
+        replies = list(replies)
+        entered = self.entered.get(flow.state)
+        if entered is not None:
+            replies += await self._take(flow, message, entered)
+        return replies
@@ -0,0 +1,128 @@
+import json
+import sqlite3
+import threading
+import time
+
+USER_FIELDS = ("total_reports_filed", "total_reports_confirmed", "accurate_reports")
+
+
+class SQLiteStore:
+    """
+    SQLite (WAL mode) storage for reporter statistics and reports waiting for
+    review. Counter updates are buffered and written in a single transaction once
+    flush_every updates have piled up, flush_interval seconds have passed, or
+    flush() is called.
+    """
+
+    def __init__(self, path="moderation.db", flush_every=100, flush_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL is durable across process crashes; only an OS crash can lose the last commit
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                total_reports_filed INTEGER NOT NULL DEFAULT 0,
+                total_reports_confirmed INTEGER NOT NULL DEFAULT 0,
+                accurate_reports INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS pending_reports (
+                report_id TEXT PRIMARY KEY,
+                enqueued_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS pending_reports_enqueued_at
+                ON pending_reports (enqueued_at);
+            """
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._deltas = {}  # Map from user id to unflushed [filed, confirmed, accurate] increments
+        self._pending_ops = 0
+        self._last_flush = time.monotonic()
+
+    def get_user(self, user):
+        # Returns (filed, confirmed, accurate) including unflushed updates, or None if unknown
+        user = str(user)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT total_reports_filed, total_reports_confirmed, accurate_reports "
+                "FROM users WHERE user_id = ?",
+                (user,),
+            ).fetchone()
+            delta = self._deltas.get(user)
+        if row is None and delta is None:
+            return None
+        row = row or (0, 0, 0)
+        delta = delta or (0, 0, 0)
+        return tuple(a + b for a, b in zip(row, delta))
+
+    def increment(self, user, field):
+        index = USER_FIELDS.index(field)
+        with self._lock:
+            self._deltas.setdefault(str(user), [0, 0, 0])[index] += 1
+            self._pending_ops += 1
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (
+            self._pending_ops >= self.flush_every
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def _write_deltas(self):
+        # Caller holds the lock and an open transaction
+        deltas, self._deltas = self._deltas, {}
+        self._pending_ops = 0
+        self._last_flush = time.monotonic()
+        if not deltas:
+            return
+        self._conn.executemany(
+            "INSERT INTO users VALUES (?, ?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET "
+            "total_reports_filed = total_reports_filed + excluded.total_reports_filed, "
+            "total_reports_confirmed = total_reports_confirmed + excluded.total_reports_confirmed, "
+            "accurate_reports = accurate_reports + excluded.accurate_reports",
+            [(user, *delta) for user, delta in deltas.items()],
+        )
+
+    def flush(self):
+        with self._lock:
+            if not self._deltas:
+                self._pending_ops = 0
+                self._last_flush = time.monotonic()
+                return
+            with self._conn:
+                self._write_deltas()
+
+    def save_report(self, report_id, enqueued_at, data):
+        # Queued reports are written straight away so none are lost on a crash. Buffered
+        # statistics go in the same transaction: restoring the report after a crash looks
+        # up its reporter's trust score, which must exist by then.
+        with self._lock, self._conn:
+            self._write_deltas()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pending_reports VALUES (?, ?, ?)",
+                (report_id, enqueued_at, json.dumps(data)),
+            )
+
+    def delete_report(self, report_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM pending_reports WHERE report_id = ?", (report_id,)
+            )
+
+    def load_reports(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT report_id, enqueued_at, data FROM pending_reports ORDER BY enqueued_at"
+            ).fetchall()
+        return [(report_id, enqueued_at, json.loads(data)) for report_id, enqueued_at, data in rows]
+
+    def close(self):
+        self.flush()
+        self._conn.close()
@@ -1,28 +1,94 @@
-import openai
 import json
+import logging
 import os
+import signal
+import threading
+
+log = logging.getLogger("modbot.tokens")
+
+
+class Credentials:
+    """
+    Loads tokens.json once and keeps the tokens in memory for every provider.
+    Call reload() (or send the process SIGHUP) after rotating a key.
+    """
+
+    def __init__(self, token_path="tokens.json"):
+        self.token_path = token_path
+        self._tokens = None
+        self._lock = threading.Lock()
+        self._reload_hooks = []
+
+    def _read(self):
+        if not os.path.isfile(self.token_path):
+            raise Exception(f"{self.token_path} not found!")
+        with open(self.token_path) as f:
+            # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
+            return json.load(f)
+
+    def get(self, name):
+        tokens = self._tokens
+        if tokens is None:
+            with self._lock:
+                if self._tokens is None:
+                    self._tokens = self._read()
+                tokens = self._tokens
+        return tokens[name]
+
+    def reload(self):
+        # Swap in the new tokens in one assignment so readers never see a half-loaded file
+        tokens = self._read()
+        with self._lock:
+            self._tokens = tokens
+        # The new tokens are live from here on; a failing hook mustn't stop the others
+        for hook in self._reload_hooks:
+            try:
+                hook(self)
+            except Exception:
+                log.exception("Reload hook %r failed after loading new tokens", hook)
+
+    def on_reload(self, hook):
+        # Register a callback for providers that bake a key into a client object
+        self._reload_hooks.append(hook)
+
+
+credentials = Credentials()
+
+
+def _reload_from_signal():
+    # A half-written or invalid tokens.json must not take the bot down. reload() only raises
+    # if the file couldn't be loaded, in which case the old tokens are still in use.
+    try:
+        credentials.reload()
+    except Exception:
+        log.exception("Reloading %s failed; keeping the current tokens", credentials.token_path)
+    else:
+        log.info("Reloaded %s", credentials.token_path)
+
+
+def install_reload_signal(loop):
+    """
+    Reloads the tokens on SIGHUP. The reload runs as a callback on loop rather
+    than inside a raw signal handler, so it never interrupts whatever the loop
+    was in the middle of.
+    """
+    # SIGHUP does not exist on Windows; there reload() has to be called directly
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, _reload_from_signal)
+
 
 def handle_tokens(model):
-    token_path = "tokens.json"
-    if not os.path.isfile(token_path):
-        raise Exception(f"{token_path} not found!")
-    with open(token_path) as f:
-        # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-        tokens = json.load(f)
-        if model == "google":
-            google_token = tokens["google"]
-            return google_token
-        elif model == "open_ai":
-            openai_token = tokens["open_ai"]
-            return openai_token
-        elif model == "chat_completion":
-            openai_organization = tokens["openai_organization"]
-            openai_token = tokens["open_ai"]
-            return openai_organization, openai_token
-        elif model == "bot":
-            discord_token = tokens["discord"]
-            google_token = tokens["google"]
-            openai_token = tokens["open_ai"]
-            return discord_token, google_token, openai_token
-        elif model == "combo":
-            return
+    if model == "google":
+        return credentials.get("google")
+    elif model == "open_ai":
+        return credentials.get("open_ai")
+    elif model == "chat_completion":
+        return credentials.get("openai_organization"), credentials.get("open_ai")
+    elif model == "bot":
+        return (
+            credentials.get("discord"),
+            credentials.get("google"),
+            credentials.get("open_ai"),
+        )
+    elif model == "combo":
+        return